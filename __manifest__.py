@@ -1,6 +1,6 @@
 {
     'name': 'Sale Ouvrage (Construction Works)',
-    'version': '1.2',
+    'version': '1.3',
     'author': 'Prelium',
     'category': 'Sales',
     'summary': 'Manage Construction Works (Ouvrages) in Sales',
@@ -8,14 +8,18 @@
         This module allows defining "Ouvrages" (Works) which are products composed of other products (BoM).
         It adds features to hide prices or structure of the ouvrage in sales orders and reports.
     """,
-    'depends': ['sale_management', 'mrp', 'sale_margin'],
+    'depends': ['sale_management', 'mrp', 'sale_mrp', 'sale_margin'],
     'data': [
         'security/ir.model.access.csv',
+        'data/ir_cron.xml',
         'reports/sale_report_templates.xml',
         'views/product_template_views.xml',
         'views/mrp_bom_views.xml',
+        'wizard/ouvrage_import_views.xml',
         'views/sale_order_views.xml',
         'views/sale_portal_templates.xml',
+        'views/sale_ouvrage_operation_log_views.xml',
+        'views/res_config_settings_views.xml',
         'wizard/ouvrage_configurator_views.xml',
     ],
     'assets': {
@@ -0,0 +1,31 @@
+import json
+
+from odoo import api, http
+from odoo.http import request
+from odoo.modules.registry import Registry
+
+
+class SaleOuvrageController(http.Controller):
+
+    @http.route('/sale_ouvrage/tree', type='json', auth='user')
+    def ouvrage_tree(self, order_ids, since=None):
+        """ Returns the Ouvrage trees of the given orders, see sale.order._get_ouvrage_tree() """
+        return request.env['sale.order'].browse(order_ids)._get_ouvrage_tree(since=since)
+
+    @http.route('/sale_ouvrage/tree/export', type='http', auth='user', methods=['GET'])
+    def ouvrage_tree_export(self, since=None, batch_size=100, **kwargs):
+        """ Streams the Ouvrage trees of all the readable orders as NDJSON, one order per line """
+        dbname, uid, context = request.db, request.env.uid, dict(request.env.context)
+        batch_size = int(batch_size)
+
+        def generate():
+            # The body is sent after the request cursor is released: read with a cursor of its own
+            with Registry(dbname).cursor() as cr:
+                env = api.Environment(cr, uid, context)
+                for tree in env['sale.order']._iter_ouvrage_trees(since=since, batch_size=batch_size):
+                    yield json.dumps(tree) + '\n'
+
+        return request.make_response(generate(), headers=[
+            ('Content-Type', 'application/x-ndjson'),
+            ('Content-Disposition', 'attachment; filename="ouvrages.ndjson"'),
+        ])
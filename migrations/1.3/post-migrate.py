@@ -0,0 +1,62 @@
+import logging
+
+from odoo import api, SUPERUSER_ID
+from odoo.tools import SQL
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Flags the order-specific BoMs created before they were told apart from catalog BoMs:
+    sequence 9999 and a code "order - date - partner" naming an existing order. Each one is
+    linked to the Ouvrage line it was created for, found through the BoM of the line, or
+    else through the order and the product of the BoM.
+    """
+    cr.execute(SQL("""
+        UPDATE mrp_bom bom
+           SET ouvrage_is_specific = TRUE
+         WHERE bom.sequence = 9999
+           AND bom.ouvrage_is_specific IS NOT TRUE
+           AND bom.code LIKE %s
+           AND EXISTS (SELECT 1 FROM sale_order so WHERE so.name = split_part(bom.code, ' - ', 1))
+     RETURNING bom.id
+    """, '% - % - %'))
+    bom_ids = [bom_id for bom_id, in cr.fetchall()]
+    if not bom_ids:
+        return
+
+    cr.execute(SQL("""
+        UPDATE mrp_bom bom
+           SET ouvrage_sale_line_id = source.line_id
+          FROM (
+                SELECT line.bom_id, MIN(line.id) AS line_id
+                  FROM sale_order_line line
+                 WHERE line.bom_id = ANY(%(bom_ids)s)
+                   AND line.ouvrage_parent_line_id IS NULL
+              GROUP BY line.bom_id
+               ) source
+         WHERE bom.id = source.bom_id
+           AND bom.ouvrage_sale_line_id IS NULL
+    """, bom_ids=bom_ids))
+    cr.execute(SQL("""
+        UPDATE mrp_bom bom
+           SET ouvrage_sale_line_id = source.line_id
+          FROM (
+                SELECT bom.id AS bom_id, MIN(line.id) AS line_id
+                  FROM mrp_bom bom
+                  JOIN sale_order so ON so.name = split_part(bom.code, ' - ', 1)
+                  JOIN sale_order_line line ON line.order_id = so.id AND line.ouvrage_parent_line_id IS NULL
+                  JOIN product_product product ON product.id = line.product_id
+                 WHERE bom.id = ANY(%(bom_ids)s)
+                   AND bom.ouvrage_sale_line_id IS NULL
+                   AND product.product_tmpl_id = bom.product_tmpl_id
+              GROUP BY bom.id
+               ) source
+         WHERE bom.id = source.bom_id
+    """, bom_ids=bom_ids))
+    _logger.info("Flagged %s order-specific BoMs", len(bom_ids))
+
+    # Specific BoMs are no longer used as sub-BoMs: refresh the explosions relying on them
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['mrp.bom'].browse(bom_ids)._get_ouvrage_explosion_dependents()._refresh_ouvrage_explosion()
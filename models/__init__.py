@@ -1,4 +1,8 @@
 from . import product_template
+from . import product_pricelist
 from . import mrp_bom
 from . import sale_order
 from . import sale_order_line
+from . import sale_ouvrage_operation_log
+from . import res_company
+from . import res_config_settings
@@ -1,14 +1,524 @@
+import hashlib
+
 from odoo import models, fields, api, exceptions
+from odoo.tools import SQL, float_compare, float_repr, float_round, split_every
+from odoo.tools.sql import create_index
+
+from ..tools import get_transaction_cache
+
+BOM_VALUES_CACHE_KEY = 'sale_ouvrage_bom_values'
+# BoM fields the flattened explosion depends on, besides the lines
+EXPLOSION_BOM_FIELDS = {'product_tmpl_id', 'product_id', 'product_qty', 'bom_line_ids', 'active', 'sequence', 'company_id', 'ouvrage_is_specific'}
+
 
 class MrpBom(models.Model):
     _inherit = 'mrp.bom'
 
     hide_prices = fields.Boolean(string="Masquer les prix par défaut")
     hide_structure = fields.Boolean(string="Masquer la structure par défaut")
+    # Order-specific BoMs, created at the confirmation of a customized Ouvrage
+    ouvrage_is_specific = fields.Boolean(string="Nomenclature spécifique", readonly=True, copy=False)
+    ouvrage_sale_line_id = fields.Many2one(
+        'sale.order.line', string="Ligne de vente d'origine", readonly=True, copy=False,
+        index='btree_not_null', ondelete='set null')
+    ouvrage_signature = fields.Char(
+        string="Signature de la structure", compute='_compute_ouvrage_signature',
+        store=True, index=True, copy=False)
+    # Components of nested Ouvrages flattened down to the leaves: list of {'product_id', 'ratio',
+    # 'product_uom_id', 'depth'}, ratio being the cumulative quantity for one unit of the product.
+    # Refreshed when the BoM or any sub-BoM of the chain changes.
+    ouvrage_explosion = fields.Json(string="Explosion à plat", readonly=True, copy=False)
 
-    @api.constrains('bom_line_ids')
-    def _check_ouvrage_recursion(self):
+    def init(self):
+        super().init()
+        # Default BoM resolution of Ouvrages only looks at catalog BoMs
+        create_index(
+            self.env.cr, 'mrp_bom_ouvrage_catalog_index', self._table,
+            ['product_tmpl_id', 'sequence', 'id'],
+            where='active AND ouvrage_is_specific IS NOT TRUE',
+        )
+
+    @api.depends('product_qty', 'bom_line_ids.product_id', 'bom_line_ids.product_qty', 'bom_line_ids.product_uom_id')
+    def _compute_ouvrage_signature(self):
         for bom in self:
+            bom.ouvrage_signature = self._get_ouvrage_signature([
+                (line.product_id.id, line.product_qty / (bom.product_qty or 1.0), line.product_uom_id.id)
+                for line in bom.bom_line_ids
+            ])
+
+    @api.model
+    def _get_ouvrage_signature(self, structure):
+        """
+        Returns a normalized signature of a BoM structure given as (product_id, quantity per unit, uom_id)
+        triplets: identical structures get the same signature, whatever the order of their lines.
+        """
+        items = sorted(
+            f"{product_id}:{float_repr(float_round(ratio, precision_digits=3), 3)}:{uom_id or 0}"
+            for product_id, ratio, uom_id in structure
+        )
+        return hashlib.sha1('|'.join(items).encode()).hexdigest()
+
+    @api.constrains('bom_line_ids', 'product_tmpl_id')
+    def _check_ouvrage_recursion(self):
+        # Nested Ouvrages are allowed, as long as no Ouvrage contains itself at any level
+        # (checked for the whole batch by the catalog upsert instead)
+        if not self or self.env.context.get('sale_ouvrage_bulk_catalog'):
+            return
+        self.flush_model(['product_tmpl_id', 'active'])
+        self.env['mrp.bom.line'].flush_model(['bom_id', 'product_id'])
+        self.env['product.product'].flush_model(['product_tmpl_id'])
+        self.env['product.template'].flush_model(['is_ouvrage'])
+        self.env.cr.execute(SQL("""
+            WITH RECURSIVE edges AS (
+                SELECT DISTINCT bom.product_tmpl_id AS parent_id, product.product_tmpl_id AS child_id
+                  FROM mrp_bom bom
+                  JOIN mrp_bom_line line ON line.bom_id = bom.id
+                  JOIN product_product product ON product.id = line.product_id
+                  JOIN product_template tmpl ON tmpl.id = product.product_tmpl_id
+                 WHERE bom.active AND tmpl.is_ouvrage
+            ), reachable(origin_id, tmpl_id) AS (
+                SELECT parent_id, child_id FROM edges WHERE parent_id = ANY(%s)
+                 UNION
+                SELECT reachable.origin_id, edges.child_id
+                  FROM reachable
+                  JOIN edges ON edges.parent_id = reachable.tmpl_id
+            )
+            SELECT origin_id FROM reachable WHERE origin_id = tmpl_id LIMIT 1
+        """, self.product_tmpl_id.ids))
+        row = self.env.cr.fetchone()
+        if row:
+            product = self.env['product.template'].browse(row[0])
+            raise exceptions.ValidationError(
+                f"L'ouvrage '{product.display_name}' ne peut pas faire partie de sa propre nomenclature, "
+                "directement ou au travers d'un sous-ouvrage.")
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self._invalidate_ouvrage_bom_cache()
+        boms = super().create(vals_list)
+        # A new BoM may become the sub-BoM of existing Ouvrages
+        boms._get_ouvrage_explosion_dependents()._refresh_ouvrage_explosion()
+        return boms
+
+    def write(self, vals):
+        if set(vals) != {'ouvrage_explosion'}:
+            self._invalidate_ouvrage_bom_cache()
+        refresh = not EXPLOSION_BOM_FIELDS.isdisjoint(vals)
+        # BoMs using the former product of the BoMs
+        dependents = self._get_ouvrage_explosion_dependents() if refresh else self.browse()
+        res = super().write(vals)
+        if refresh:
+            (dependents | self._get_ouvrage_explosion_dependents())._refresh_ouvrage_explosion()
+        return res
+
+    def unlink(self):
+        self._invalidate_ouvrage_bom_cache()
+        dependents = self._get_ouvrage_explosion_dependents() - self
+        res = super().unlink()
+        dependents.exists()._refresh_ouvrage_explosion()
+        return res
+
+    def _get_ouvrage_explosion_dependents(self):
+        """
+        Returns the BoMs whose flattened explosion depends on the BoMs in self: themselves and
+        every BoM using their product as a component, at any level, found with one recursive query.
+        Only BoMs of Ouvrages have an explosion: other BoMs are left out without any query.
+        During a catalog upsert, the explosions are only refreshed once at the end.
+        """
+        boms = self.filtered(lambda bom: bom.product_tmpl_id.is_ouvrage)
+        if not boms or self.env.context.get('sale_ouvrage_bulk_catalog'):
+            return self.browse()
+        self.flush_model(['product_tmpl_id'])
+        self.env['mrp.bom.line'].flush_model(['bom_id', 'product_id'])
+        self.env['product.product'].flush_model(['product_tmpl_id'])
+        self.env['product.template'].flush_model(['is_ouvrage'])
+        self.env.cr.execute(SQL("""
+            WITH RECURSIVE ancestors(tmpl_id) AS (
+                SELECT product_tmpl_id FROM mrp_bom WHERE id = ANY(%(bom_ids)s)
+                 UNION
+                SELECT bom.product_tmpl_id
+                  FROM ancestors
+                  JOIN product_template tmpl ON tmpl.id = ancestors.tmpl_id AND tmpl.is_ouvrage
+                  JOIN product_product product ON product.product_tmpl_id = tmpl.id
+                  JOIN mrp_bom_line line ON line.product_id = product.id
+                  JOIN mrp_bom bom ON bom.id = line.bom_id
+            )
+            SELECT DISTINCT line.bom_id
+              FROM ancestors
+              JOIN product_template tmpl ON tmpl.id = ancestors.tmpl_id AND tmpl.is_ouvrage
+              JOIN product_product product ON product.product_tmpl_id = tmpl.id
+              JOIN mrp_bom_line line ON line.product_id = product.id
+              JOIN mrp_bom parent ON parent.id = line.bom_id
+              JOIN product_template parent_tmpl ON parent_tmpl.id = parent.product_tmpl_id AND parent_tmpl.is_ouvrage
+        """, bom_ids=boms.ids))
+        return boms | self.browse(bom_id for bom_id, in self.env.cr.fetchall())
+
+    def _refresh_ouvrage_explosion(self):
+        """ Recomputes the flattened explosion of the BoMs of Ouvrages, sharing the explosion of common sub-BoMs """
+        memo = {}
+        for bom in self.filtered(lambda bom: bom.product_tmpl_id.is_ouvrage):
+            bom.ouvrage_explosion = bom._compute_ouvrage_explosion_items(memo)
+
+    def _compute_ouvrage_explosion_items(self, memo=None):
+        """ Flattens the BoM down to its non-Ouvrage components, through the default BoM of the nested Ouvrages """
+        self.ensure_one()
+        memo = {} if memo is None else memo
+        if self.id in memo:
+            return memo[self.id]
+        # Guard against a cycle being written, rejected by the constraint
+        memo[self.id] = []
+        sub_bom_values = self._get_ouvrage_bom_values(
+            self.bom_line_ids.product_id.product_tmpl_id.filtered('is_ouvrage'))
+        items = []
+        for line in self.bom_line_ids:
+            # Quantity of the line for one unit of the product of the BoM
+            ratio = line.product_qty / (self.product_qty or 1.0)
+            sub_values = sub_bom_values.get(line.product_id.product_tmpl_id.id)
+            if sub_values:
+                # Explosion of the sub-BoM, already per unit of the sub-Ouvrage
+                sub_bom = self.browse(sub_values['bom_id'])
+                items += [
+                    dict(item, ratio=item['ratio'] * ratio, depth=item['depth'] + 1)
+                    for item in sub_bom._compute_ouvrage_explosion_items(memo)
+                ]
+            else:
+                items.append({
+                    'product_id': line.product_id.id,
+                    'ratio': ratio,
+                    'product_uom_id': line.product_uom_id.id,
+                    'depth': 1,
+                })
+        memo[self.id] = items
+        return items
+
+    def _get_ouvrage_explosion_signature(self):
+        """
+        Returns the signature of the flattened explosion, comparable with the structure of an
+        Ouvrage in a quotation. Same as ouvrage_signature for BoMs without nested Ouvrages.
+        """
+        self.ensure_one()
+        return self._get_ouvrage_signature([
+            (product.id, ratio, uom.id) for product, ratio, uom, _depth in self._get_ouvrage_explosion()
+        ])
+
+    def _get_ouvrage_explosion(self):
+        """
+        Returns the flattened explosion of the BoM as (product, ratio, uom, depth) tuples,
+        read from the stored explosion (computed on the fly for BoMs never refreshed).
+        """
+        self.ensure_one()
+        items = self.ouvrage_explosion
+        if items is None or items is False:
+            items = self._compute_ouvrage_explosion_items()
+        products = self.env['product.product'].browse([item['product_id'] for item in items])
+        uoms = self.env['uom.uom'].browse([item['product_uom_id'] for item in items])
+        return [
+            (product, item['ratio'], uom, item['depth'])
+            for product, uom, item in zip(products, uoms, items)
+        ]
+
+    @api.model
+    def _get_ouvrage_bom_values(self, product_templates):
+        """
+        Resolves the default BoM of a batch of Ouvrage product templates.
+        Returns {template_id: {'bom_id', 'hide_prices', 'hide_structure', 'price'}}, where
+        price is the sum of the components list prices. Templates without BoM are left out.
+        The result is memoized for the current transaction.
+        """
+        transaction_cache = get_transaction_cache(self.env, BOM_VALUES_CACHE_KEY)
+        # BoM visibility depends on the user and its companies
+        cache = transaction_cache.setdefault((self.env.uid, tuple(self.env.companies.ids)), {})
+
+        missing_ids = [tmpl_id for tmpl_id in product_templates.ids if tmpl_id not in cache]
+        if missing_ids:
+            default_boms = {}
+            # Same ordering as search(..., limit=1) for each template, order-specific BoMs excluded
+            catalog_boms = self.search([('product_tmpl_id', 'in', missing_ids), ('ouvrage_is_specific', '=', False)])
+            for bom in catalog_boms:
+                default_boms.setdefault(bom.product_tmpl_id.id, bom)
+            prices = self._get_ouvrage_bom_prices([bom.id for bom in default_boms.values()])
+            for tmpl_id in missing_ids:
+                bom = default_boms.get(tmpl_id)
+                cache[tmpl_id] = bom and {
+                    'bom_id': bom.id,
+                    'hide_prices': bom.hide_prices,
+                    'hide_structure': bom.hide_structure,
+                    'price': prices.get(bom.id, 0.0),
+                }
+
+        return {tmpl_id: cache[tmpl_id] for tmpl_id in product_templates.ids if cache[tmpl_id]}
+
+    @api.model
+    def _get_ouvrage_bom_prices(self, bom_ids):
+        """ Returns {bom_id: sum of list_price * ratio of its flattened components} """
+        boms = self.browse(bom_ids)
+        explosions = {bom.id: bom._get_ouvrage_explosion() for bom in boms}
+        # Read the list prices of all the components at once
+        products = self.env['product.product'].browse({
+            product.id for explosion in explosions.values() for product, _ratio, _uom, _depth in explosion
+        })
+        products.fetch(['list_price'])
+        return {
+            bom_id: sum(product.list_price * ratio for product, ratio, _uom, _depth in explosion)
+            for bom_id, explosion in explosions.items()
+        }
+
+    @api.model
+    def _ouvrage_catalog_upsert(self, catalog, chunk_size=500):
+        """
+        Creates or updates Ouvrage catalog BoMs in bulk. `catalog` is a list of dicts:
+            {'product_tmpl_id', 'product_qty', 'hide_prices', 'hide_structure',
+             'lines': [{'product_id', 'product_qty', 'product_uom_id'}]}
+        each matched with the default catalog BoM of its template, created when there is none.
+        The components of the whole batch are validated at once, existing BoM lines are updated
+        by diff, and invalid BoMs are reported without aborting the batch.
+        Returns {'created': int, 'updated': int, 'errors': [(catalog index, message)]}.
+        """
+        result = {'created': 0, 'updated': 0, 'errors': []}
+        entries = self._ouvrage_catalog_validate(catalog, result['errors'])
+        Bom = self.with_context(sale_ouvrage_bulk_catalog=True)
+        boms = self.browse()
+        for chunk in split_every(chunk_size, entries, list):
+            boms |= Bom._ouvrage_catalog_upsert_chunk(chunk, result)
+            # Keep memory bounded
+            self.env.flush_all()
+            self.env.invalidate_all()
+
+        # One refresh of the flattened explosions for the whole batch
+        boms = self.browse(boms.ids)
+        boms._get_ouvrage_explosion_dependents()._refresh_ouvrage_explosion()
+        result['errors'].sort()
+        return result
+
+    @api.model
+    def _ouvrage_catalog_validate(self, catalog, errors):
+        """
+        Validates the catalog entries for the whole batch: components are checked with one query
+        and cycles against the existing Ouvrage BoM graph. Appends (index, message) to `errors`
+        and returns the valid (index, entry) pairs.
+        """
+        template_ids = {entry.get('product_tmpl_id') for entry in catalog}
+        product_ids = {line.get('product_id') for entry in catalog for line in entry.get('lines', [])}
+        self.env['product.product'].flush_model(['product_tmpl_id', 'active'])
+        self.env['product.template'].flush_model(['is_ouvrage', 'uom_id'])
+        self.env.cr.execute(SQL("""
+            SELECT 'template', tmpl.id, tmpl.id, tmpl.active, tmpl.is_ouvrage, tmpl.uom_id
+              FROM product_template tmpl
+             WHERE tmpl.id = ANY(%(template_ids)s)
+             UNION ALL
+            SELECT 'product', product.id, product.product_tmpl_id, product.active, tmpl.is_ouvrage, tmpl.uom_id
+              FROM product_product product
+              JOIN product_template tmpl ON tmpl.id = product.product_tmpl_id
+             WHERE product.id = ANY(%(product_ids)s)
+        """, template_ids=[tmpl_id for tmpl_id in template_ids if isinstance(tmpl_id, int)],
+             product_ids=[product_id for product_id in product_ids if isinstance(product_id, int)]))
+        templates, products = {}, {}
+        for kind, record_id, tmpl_id, active, is_ouvrage, uom_id in self.env.cr.fetchall():
+            (templates if kind == 'template' else products)[record_id] = (tmpl_id, active, is_ouvrage, uom_id)
+
+        entries = []
+        seen_templates = set()
+        for index, entry in enumerate(catalog):
+            tmpl_id = entry.get('product_tmpl_id')
+            error = None
+            if tmpl_id not in templates or not templates[tmpl_id][2]:
+                error = "Le produit de la nomenclature n'existe pas ou n'est pas un ouvrage."
+            elif tmpl_id in seen_templates:
+                error = "Ce produit apparaît plusieurs fois dans le catalogue."
+            for line in entry.get('lines', []):
+                if error:
+                    break
+                product = products.get(line.get('product_id'))
+                if not product or not product[1]:
+                    error = f"Le composant {line.get('product_id')} n'existe pas ou est archivé."
+                elif product[0] == tmpl_id:
+                    error = "Un ouvrage ne peut pas faire partie de sa propre nomenclature."
+                elif float_compare(line.get('product_qty', 1.0), 0.0, precision_digits=6) <= 0:
+                    error = f"La quantité du composant {line.get('product_id')} doit être positive."
+            if error:
+                errors.append((index, error))
+                continue
+            seen_templates.add(tmpl_id)
+            entries.append((index, dict(entry, lines=[
+                dict(line, product_uom_id=line.get('product_uom_id') or products[line['product_id']][3])
+                for line in entry.get('lines', [])
+            ])))
+
+        # Graph of the nested Ouvrages: existing BoMs, with the structures of the batch instead of
+        # the default BoMs they replace
+        default_boms = self._get_ouvrage_bom_values(self.env['product.template'].browse(seen_templates))
+        self.flush_model(['product_tmpl_id', 'active'])
+        self.env['mrp.bom.line'].flush_model(['bom_id', 'product_id'])
+        self.env.cr.execute(SQL("""
+            SELECT DISTINCT bom.product_tmpl_id, product.product_tmpl_id
+              FROM mrp_bom bom
+              JOIN mrp_bom_line line ON line.bom_id = bom.id
+              JOIN product_product product ON product.id = line.product_id
+              JOIN product_template tmpl ON tmpl.id = product.product_tmpl_id
+             WHERE bom.active AND tmpl.is_ouvrage AND bom.id != ALL(%s)
+        """, [values['bom_id'] for values in default_boms.values()]))
+        edges = {}
+        for parent_id, child_id in self.env.cr.fetchall():
+            edges.setdefault(parent_id, set()).add(child_id)
+        for _index, entry in entries:
+            edges.setdefault(entry['product_tmpl_id'], set()).update(
+                products[line['product_id']][0] for line in entry['lines'] if products[line['product_id']][2])
+
+        def reaches_itself(tmpl_id):
+            seen, stack = set(), list(edges.get(tmpl_id, ()))
+            while stack:
+                child_id = stack.pop()
+                if child_id == tmpl_id:
+                    return True
+                if child_id not in seen:
+                    seen.add(child_id)
+                    stack.extend(edges.get(child_id, ()))
+            return False
+
+        valid_entries = []
+        for index, entry in entries:
+            if reaches_itself(entry['product_tmpl_id']):
+                errors.append((index, "L'ouvrage ferait partie de sa propre nomenclature au travers d'un sous-ouvrage."))
+            else:
+                valid_entries.append((index, entry))
+        return valid_entries
+
+    def _ouvrage_catalog_upsert_chunk(self, chunk, result):
+        """ Upserts a chunk of catalog entries in batch, falling back to entry by entry on error """
+        try:
+            with self.env.cr.savepoint():
+                boms, created = self._ouvrage_catalog_apply(chunk)
+            result['created'] += created
+            result['updated'] += len(chunk) - created
+            return boms
+        except exceptions.UserError:
+            pass
+
+        boms = self.browse()
+        for index, entry in chunk:
+            try:
+                with self.env.cr.savepoint():
+                    entry_boms, created = self._ouvrage_catalog_apply([(index, entry)])
+                boms |= entry_boms
+                result['created'] += created
+                result['updated'] += 1 - created
+            except exceptions.UserError as e:
+                result['errors'].append((index, str(e)))
+        return boms
+
+    def _ouvrage_catalog_apply(self, chunk):
+        """
+        Writes catalog entries: new BoMs in one create, and for existing BoMs their changed
+        fields and lines grouped by values, new lines in one create and removed lines in one unlink.
+        Returns (BoMs, number of created BoMs).
+        """
+        BomLine = self.env['mrp.bom.line']
+        default_boms = self._get_ouvrage_bom_values(
+            self.env['product.template'].browse([entry['product_tmpl_id'] for _index, entry in chunk]))
+        new_boms = []
+        bom_writes, line_writes = {}, {}
+        new_lines = []
+        obsolete_lines = BomLine
+        boms = self.browse()
+        for _index, entry in chunk:
+            bom_vals = {fname: entry[fname] for fname in ('product_qty', 'hide_prices', 'hide_structure') if fname in entry}
+            lines_vals = [
+                {fname: line[fname] for fname in ('product_id', 'product_qty', 'product_uom_id') if fname in line}
+                for line in entry['lines']
+            ]
+            default_bom = default_boms.get(entry['product_tmpl_id'])
+            if not default_bom:
+                new_boms.append(dict(bom_vals, product_tmpl_id=entry['product_tmpl_id'], bom_line_ids=[
+                    (0, 0, line_vals) for line_vals in lines_vals
+                ]))
+                continue
+
+            bom = self.browse(default_bom['bom_id'])
+            boms |= bom
+            changes = {fname: value for fname, value in bom_vals.items() if bom[fname] != value}
+            if changes:
+                bom_writes.setdefault(tuple(sorted(changes.items())), []).append(bom.id)
+            # Match the lines by product, in order
+            remaining = {}
             for line in bom.bom_line_ids:
-                if line.product_id.is_ouvrage:
-                    raise exceptions.ValidationError("Il n'est pas possible d'ajouter des produits qui sont cochés 'Ouvrage' au niveau des composants de la nomenclature.")
+                remaining.setdefault(line.product_id.id, []).append(line)
+            for line_vals in lines_vals:
+                matches = remaining.get(line_vals['product_id'])
+                if not matches:
+                    new_lines.append(dict(line_vals, bom_id=bom.id))
+                    continue
+                line = matches.pop(0)
+                current = {'product_id': line.product_id.id, 'product_qty': line.product_qty, 'product_uom_id': line.product_uom_id.id}
+                line_changes = {fname: value for fname, value in line_vals.items() if current[fname] != value}
+                if line_changes:
+                    line_writes.setdefault(tuple(sorted(line_changes.items())), []).append(line.id)
+            for lines in remaining.values():
+                obsolete_lines = obsolete_lines.union(*lines)
+
+        if obsolete_lines:
+            obsolete_lines.unlink()
+        for changes, bom_ids in bom_writes.items():
+            self.browse(bom_ids).write(dict(changes))
+        for changes, line_ids in line_writes.items():
+            BomLine.browse(line_ids).write(dict(changes))
+        if new_lines:
+            BomLine.create(new_lines)
+        if new_boms:
+            boms |= self.create(new_boms)
+        return boms, len(new_boms)
+
+    @api.model
+    def _cron_archive_specific_ouvrage_boms(self):
+        """
+        Archives the order-specific BoMs that are no longer needed: no open quotation,
+        unlocked sale order nor ongoing manufacturing order uses them.
+        """
+        boms = self.search([('ouvrage_is_specific', '=', True)])
+        if not boms:
+            return
+        used_by_sales = self.env['sale.order.line']._read_group([
+            ('bom_id', 'in', boms.ids),
+            '|', ('order_id.state', 'in', ('draft', 'sent')),
+                 '&', ('order_id.state', '=', 'sale'), ('order_id.locked', '=', False),
+        ], ['bom_id'])
+        used_by_productions = self.env['mrp.production']._read_group([
+            ('bom_id', 'in', boms.ids),
+            ('state', 'not in', ('done', 'cancel')),
+        ], ['bom_id'])
+        used_boms = self.browse([bom.id for bom, in used_by_sales + used_by_productions])
+        (boms - used_boms).write({'active': False})
+
+    @api.model
+    def _invalidate_ouvrage_bom_cache(self):
+        transaction_cache = self.env.cr.cache.get(BOM_VALUES_CACHE_KEY)
+        if transaction_cache:
+            transaction_cache.clear()
+
+    @api.model
+    def _drop_ouvrage_bom_cache(self):
+        self.env.cr.cache.pop(BOM_VALUES_CACHE_KEY, None)
+
+
+class MrpBomLine(models.Model):
+    _inherit = 'mrp.bom.line'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.env['mrp.bom']._invalidate_ouvrage_bom_cache()
+        lines = super().create(vals_list)
+        lines.bom_id._get_ouvrage_explosion_dependents()._refresh_ouvrage_explosion()
+        return lines
+
+    def write(self, vals):
+        self.env['mrp.bom']._invalidate_ouvrage_bom_cache()
+        boms = self.bom_id
+        res = super().write(vals)
+        (boms | self.bom_id)._get_ouvrage_explosion_dependents()._refresh_ouvrage_explosion()
+        return res
+
+    def unlink(self):
+        self.env['mrp.bom']._invalidate_ouvrage_bom_cache()
+        boms = self.bom_id
+        res = super().unlink()
+        boms.exists()._get_ouvrage_explosion_dependents()._refresh_ouvrage_explosion()
+        return res
@@ -0,0 +1,86 @@
+from bisect import bisect_right
+
+from odoo import models, api
+
+from ..tools import get_transaction_cache
+
+PRICES_CACHE_KEY = 'sale_ouvrage_pricelist_prices'
+
+
+class ProductPricelist(models.Model):
+    _inherit = 'product.pricelist'
+
+    def _get_ouvrage_component_prices(self, product_quantities, date=False):
+        """
+        Returns {(product_id, quantity): price} for a batch of (product, quantity) pairs.
+        Pricelist rules only depend on the quantity through their minimum quantity, so
+        quantities are reduced to their bracket: the products of a bracket are priced in one
+        batched pricelist computation, memoized per pricelist, date and bracket for the
+        transaction.
+        """
+        self.ensure_one()
+        cache = get_transaction_cache(self.env, PRICES_CACHE_KEY)
+
+        brackets = self._get_ouvrage_quantity_brackets()
+        # bracket: (quantity used to price the bracket, products)
+        products_by_bracket = {}
+        pair_brackets = {}
+        for product, quantity in product_quantities:
+            index = bisect_right(brackets, quantity)
+            bracket = brackets[index - 1] if index else 0.0
+            pair_brackets[(product.id, quantity)] = bracket
+            # Any quantity of the bracket gives the same price
+            bracket_quantity, products = products_by_bracket.get(bracket, (quantity, self.env['product.product']))
+            products_by_bracket[bracket] = (bracket_quantity, products | product)
+
+        prices_by_bracket = {}
+        for bracket, (bracket_quantity, products) in products_by_bracket.items():
+            prices = cache.setdefault((self.id, date, bracket), {})
+            missing = products.filtered(lambda p: p.id not in prices)
+            if missing:
+                prices.update(self._get_products_price(missing, bracket_quantity, date=date))
+            prices_by_bracket[bracket] = prices
+
+        return {
+            (product_id, quantity): prices_by_bracket[bracket][product_id]
+            for (product_id, quantity), bracket in pair_brackets.items()
+        }
+
+    def _get_ouvrage_quantity_brackets(self):
+        """ Returns the sorted minimum quantities of the rules of the pricelist and its base pricelists """
+        self.ensure_one()
+        cache = get_transaction_cache(self.env, PRICES_CACHE_KEY)
+        key = ('brackets', self.id)
+        if key not in cache:
+            pricelists = self.browse()
+            to_visit = self
+            while to_visit:
+                pricelists |= to_visit
+                to_visit = to_visit.sudo().item_ids.base_pricelist_id - pricelists
+            items = self.env['product.pricelist.item'].sudo().search([
+                ('pricelist_id', 'in', pricelists.ids),
+                ('min_quantity', '>', 0),
+            ])
+            cache[key] = sorted(set(items.mapped('min_quantity')))
+        return cache[key]
+
+    @api.model
+    def _invalidate_ouvrage_prices_cache(self):
+        self.env.cr.cache.pop(PRICES_CACHE_KEY, None)
+
+
+class ProductPricelistItem(models.Model):
+    _inherit = 'product.pricelist.item'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.env['product.pricelist']._invalidate_ouvrage_prices_cache()
+        return super().create(vals_list)
+
+    def write(self, vals):
+        self.env['product.pricelist']._invalidate_ouvrage_prices_cache()
+        return super().write(vals)
+
+    def unlink(self):
+        self.env['product.pricelist']._invalidate_ouvrage_prices_cache()
+        return super().unlink()
@@ -4,3 +4,21 @@ class ProductTemplate(models.Model):
     _inherit = 'product.template'
 
     is_ouvrage = fields.Boolean(string="Est un ouvrage", help="Check this box if this product is a construction work (Ouvrage).")
+    list_price_date = fields.Datetime(string="Date du prix de vente", readonly=True, copy=False)
+
+    def write(self, vals):
+        if 'list_price' in vals:
+            # Ouvrage prices are computed from the components list prices
+            self.env['mrp.bom']._invalidate_ouvrage_bom_cache()
+            self.env['product.pricelist']._invalidate_ouvrage_prices_cache()
+            # Open quotations using this product as component get repriced by a cron
+            vals = dict(vals, list_price_date=fields.Datetime.now())
+        if 'is_ouvrage' in vals:
+            self.env['mrp.bom']._invalidate_ouvrage_bom_cache()
+        res = super().write(vals)
+        if 'is_ouvrage' in vals:
+            # The BoMs using these products now explode (or no longer explode) them
+            boms = self.env['mrp.bom.line'].search([('product_tmpl_id', 'in', self.ids)]).bom_id
+            boms._check_ouvrage_recursion()
+            boms._get_ouvrage_explosion_dependents()._refresh_ouvrage_explosion()
+        return res
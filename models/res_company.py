@@ -0,0 +1,9 @@
+from odoo import models, fields
+
+class ResCompany(models.Model):
+    _inherit = 'res.company'
+
+    ouvrage_bom_async = fields.Boolean(
+        string="Génération différée des nomenclatures spécifiques",
+        help="Confirming an order only captures the structure of its customized Ouvrages; "
+             "their specific BoMs are generated by a scheduled action, or before manufacturing.")
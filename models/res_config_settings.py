@@ -0,0 +1,6 @@
+from odoo import models, fields
+
+class ResConfigSettings(models.TransientModel):
+    _inherit = 'res.config.settings'
+
+    ouvrage_bom_async = fields.Boolean(related='company_id.ouvrage_bom_async', readonly=False)
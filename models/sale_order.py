@@ -1,42 +1,217 @@
-from odoo import models, fields, api
+import copy
+import logging
+from collections import defaultdict
+
+from odoo import models, fields, api, exceptions
+from odoo.tools import split_every
+
+from ..tools import get_transaction_cache
+
+_logger = logging.getLogger(__name__)
+
+TAX_TOTALS_CACHE_KEY = 'sale_ouvrage_tax_totals'
+# Fields of the lines exported by the Ouvrage tree API
+OUVRAGE_TREE_LINE_FIELDS = [
+    'order_id', 'ouvrage_parent_line_id', 'sequence', 'display_type', 'name', 'product_id',
+    'product_uom_qty', 'product_uom_id', 'ouvrage_qty_per_unit', 'price_unit', 'discount',
+    'price_subtotal', 'price_total', 'purchase_price', 'bom_id', 'hide_prices', 'hide_structure',
+    'ouvrage_margin', 'ouvrage_margin_pct', 'ouvrage_visible_in_documents', 'ouvrage_prices_hidden',
+    'write_date',
+]
+
 
 class SaleOrder(models.Model):
     _inherit = 'sale.order'
 
-    def action_confirm(self):
-        # Pre-confirmation logic: Check/Create BoMs
+    @api.model_create_multi
+    def create(self, vals_list):
+        orders = super().create(vals_list)
+        # Reprice the Ouvrages whose components were saved with the order
+        self.env['sale.order.line']._process_ouvrage_reprice_queue()
+        return orders
+
+    def write(self, vals):
+        res = super().write(vals)
+        # Reprice the Ouvrages whose components were saved with the order
+        self.env['sale.order.line']._process_ouvrage_reprice_queue()
+        return res
+
+    def web_read(self, specification):
+        line_spec = specification.get('order_line')
+        if not line_spec or not (line_spec.get('context') or {}).get('ouvrage_lazy_components'):
+            return super().web_read(specification)
+        # The order form only loads the top-level lines: the components are fetched by batches
+        # when their Ouvrage is expanded (see read_ouvrage_components)
+        values_list = super().web_read({fname: spec for fname, spec in specification.items() if fname != 'order_line'})
+        SaleOrderLine = self.env['sale.order.line'].with_context(**line_spec['context'])
+        top_lines = SaleOrderLine.search(
+            [('order_id', 'in', self.ids), ('ouvrage_parent_line_id', '=', False)],
+            order=line_spec.get('order') or None,
+        )
+        lines_by_order = top_lines.grouped('order_id')
+        limit = line_spec.get('limit')
+        to_read = SaleOrderLine.browse()
         for order in self:
-            for line in order.order_line:
-                if line.is_ouvrage and line.bom_id:
-                    self._check_and_create_specific_bom(line)
+            to_read |= lines_by_order.get(order, SaleOrderLine)[:limit]
+        read_values = {}
+        if 'fields' in line_spec:
+            read_values = {values['id']: values for values in to_read.web_read(line_spec['fields'])}
+        for order, values in zip(self, values_list):
+            line_ids = lines_by_order.get(order, SaleOrderLine).ids
+            if 'fields' in line_spec:
+                line_ids = [read_values.get(line_id) or {'id': line_id} for line_id in line_ids]
+            values['order_line'] = line_ids
+        return values_list
+
+    def copy(self, default=None):
+        # Ouvrage trees are copied as they are: no explosion nor repricing of the copied Ouvrages.
+        # The lines are copied here rather than by sale, to know which line each copy comes from.
+        default = dict(default or {})
+        copy_lines = 'order_line' not in default
+        if copy_lines:
+            default['order_line'] = []
+        new_orders = super(SaleOrder, self.with_context(sale_ouvrage_copy=True)).copy(default)
+        new_orders = new_orders.with_env(self.env)
+        if copy_lines:
+            self._copy_ouvrage_lines(new_orders)
+        return new_orders
+
+    def _copy_ouvrage_lines(self, new_orders):
+        """
+        Copies the lines of the orders into their copies, down payments excluded: the Ouvrages
+        and other lines first, then the components linked to the copies of their Ouvrages.
+        """
+        SaleOrderLine = self.env['sale.order.line'].with_context(sale_ouvrage_copy=True)
+        lines, lines_vals = SaleOrderLine, []
+        components, components_vals = SaleOrderLine, []
+        for order, new_order in zip(self, new_orders):
+            # With the context, copy_data keeps the prices of the Ouvrages and their components
+            order_lines = order.order_line.with_context(sale_ouvrage_copy=True).filtered(lambda l: not l.is_downpayment)
+            # copy_data returns the values of each line, in the order of the lines
+            for line, vals in zip(order_lines, order_lines.copy_data({'order_id': new_order.id})):
+                if line.ouvrage_parent_line_id:
+                    components |= line
+                    components_vals.append(vals)
+                else:
+                    lines |= line
+                    lines_vals.append(vals)
+
+        # create returns the new lines in the order of their values
+        new_lines = SaleOrderLine.create(lines_vals)
+        new_line_ids = dict(zip(lines.ids, new_lines.ids))
+        for component, vals in zip(components, components_vals):
+            parent = component.ouvrage_parent_line_id
+            if parent.id not in new_line_ids:
+                raise exceptions.UserError(
+                    f"Le composant '{component.display_name}' ne peut pas être copié : "
+                    f"son ouvrage '{parent.display_name}' ne fait pas partie des lignes copiées.")
+            vals['ouvrage_parent_line_id'] = new_line_ids[parent.id]
+        SaleOrderLine.create(components_vals)
+
+    def action_confirm(self):
+        # Pre-confirmation logic: Check/Create BoMs, for all the orders at once
+        ouvrage_lines = self.order_line.filtered(lambda l: l.is_ouvrage and l.bom_id)
+        # Companies with deferred generation only capture the structure, see _cron_materialize_ouvrage_boms
+        deferred_lines = ouvrage_lines.filtered(lambda l: l.company_id.ouvrage_bom_async)
+        deferred_lines._snapshot_ouvrage_structure()
+        if deferred_lines.filtered('ouvrage_bom_pending'):
+            self.env.ref('sale_ouvrage.ir_cron_materialize_ouvrage_boms')._trigger()
+        self._check_and_create_specific_bom(ouvrage_lines - deferred_lines)
         
         return super().action_confirm()
 
+    def action_recompute_ouvrage_margin(self):
+        """ Maintenance action: recomputes the margin of all the Ouvrages of the orders at once """
+        self.order_line._recompute_ouvrage_margin()
+
+    def _get_ouvrage_tree(self, since=None):
+        """
+        Returns the lines of the orders as trees of Ouvrages and components, with their
+        quantities, prices, margins and visibility in customer documents, for the integrations.
+        With `since`, only the orders modified since that date, or with lines modified since
+        then, are returned (with their full tree). Built with a fixed number of queries,
+        whatever the number of orders and lines.
+        """
+        self.check_access('read')
+        orders = self
+        if since:
+            since = fields.Datetime.to_datetime(since)
+            orders = self.search([
+                ('id', 'in', self.ids),
+                '|', ('write_date', '>=', since), ('order_line.write_date', '>=', since),
+            ])
+        orders.fetch(['name', 'state', 'currency_id', 'amount_untaxed', 'amount_total', 'write_date'])
+        lines = self.env['sale.order.line'].search_fetch(
+            [('order_id', 'in', orders.ids)], OUVRAGE_TREE_LINE_FIELDS, order='order_id, sequence, id')
+
+        top_lines = defaultdict(list)
+        components = defaultdict(list)
+        for line in lines:
+            values = line._get_ouvrage_tree_values()
+            if line.ouvrage_parent_line_id:
+                components[line.ouvrage_parent_line_id.id].append(values)
+            else:
+                top_lines[line.order_id.id].append(values)
+        for values_list in top_lines.values():
+            for values in values_list:
+                if values['is_ouvrage']:
+                    values['components'] = components.get(values['id'], [])
+
+        return [{
+            'id': order.id,
+            'name': order.name,
+            'state': order.state,
+            'currency': order.currency_id.name,
+            'amount_untaxed': order.amount_untaxed,
+            'amount_total': order.amount_total,
+            'write_date': fields.Datetime.to_string(order.write_date),
+            'lines': top_lines.get(order.id, []),
+        } for order in orders]
+
+    @api.model
+    def _iter_ouvrage_trees(self, domain=None, since=None, batch_size=100):
+        """ Yields the Ouvrage trees of the orders matching the domain, by batches of orders """
+        domain = list(domain or [])
+        if since:
+            since = fields.Datetime.to_datetime(since)
+            domain += ['|', ('write_date', '>=', since), ('order_line.write_date', '>=', since)]
+        order_ids = self.search(domain, order='id').ids
+        for batch_ids in split_every(batch_size, order_ids):
+            yield from self.browse(batch_ids)._get_ouvrage_tree()
+            # Keep memory bounded for large exports
+            self.env.invalidate_all()
+
+    def _simulate_ouvrage_reprice(self):
+        """
+        Returns {order_id: (current untaxed amount, untaxed amount after repricing)} for the
+        components with a stale price, without writing anything.
+        """
+        current = {order.id: order.amount_untaxed for order in self}
+        with self.env.cr.savepoint() as savepoint:
+            self.order_line._reprice_stale_ouvrage_components()
+            self.env.flush_all()
+            repriced = {order.id: order.amount_untaxed for order in self}
+            savepoint.rollback()
+            # Drop the repriced values from the cache, without writing them
+            self.env.invalidate_all(flush=False)
+        return {order_id: (current[order_id], repriced[order_id]) for order_id in current}
+
+    def _get_order_lines_to_report(self):
+        # Components of Ouvrages with a hidden structure are not shown in reports and portal
+        return super()._get_order_lines_to_report().filtered('ouvrage_visible_in_documents')
+
     @api.depends('order_line.price_subtotal', 'currency_id', 'company_id', 'payment_term_id')
     def _compute_amounts(self):
         """
         Override to exclude Ouvrage lines from the total amount.
         We only want them to display a price locally but not impact the order total.
         """
-        AccountTax = self.env['account.tax']
-        for order in self:
-            # Filter out Ouvrage lines from the total calculation
-            order_lines = order.order_line.filtered(lambda x: not x.display_type and not x.is_ouvrage)
-            
-            base_lines = [line._prepare_base_line_for_taxes_computation() for line in order_lines]
-            base_lines += order._add_base_lines_for_early_payment_discount()
-            
-            AccountTax._add_tax_details_in_base_lines(base_lines, order.company_id)
-            AccountTax._round_base_lines_tax_details(base_lines, order.company_id)
-            
-            tax_totals = AccountTax._get_tax_totals_summary(
-                base_lines=base_lines,
-                currency=order.currency_id or order.company_id.currency_id,
-                company=order.company_id,
-            )
-            order.amount_untaxed = tax_totals['base_amount_currency']
-            order.amount_tax = tax_totals['tax_amount_currency']
-            order.amount_total = tax_totals['total_amount_currency']
+        with self.env['sale.ouvrage.operation.log']._profile('amounts', self):
+            for order in self:
+                tax_totals = order._get_ouvrage_tax_totals()
+                order.amount_untaxed = tax_totals['base_amount_currency']
+                order.amount_tax = tax_totals['tax_amount_currency']
+                order.amount_total = tax_totals['total_amount_currency']
 
     @api.depends('order_line.price_subtotal', 'currency_id', 'company_id', 'payment_term_id')
     def _compute_tax_totals(self):
@@ -44,76 +219,246 @@ class SaleOrder(models.Model):
         Override to exclude Ouvrage lines from the tax totals computation.
         This fixes the display in the portal and reports.
         """
-        AccountTax = self.env['account.tax']
         for order in self:
-            # Filter out Ouvrage lines
-            order_lines = order.order_line.filtered(lambda x: not x.display_type and not x.is_ouvrage)
-            
-            base_lines = [line._prepare_base_line_for_taxes_computation() for line in order_lines]
-            base_lines += order._add_base_lines_for_early_payment_discount()
-            
-            AccountTax._add_tax_details_in_base_lines(base_lines, order.company_id)
-            AccountTax._round_base_lines_tax_details(base_lines, order.company_id)
-            
-            order.tax_totals = AccountTax._get_tax_totals_summary(
-                base_lines=base_lines,
-                currency=order.currency_id or order.company_id.currency_id,
-                company=order.company_id,
-            )
+            order.tax_totals = order._get_ouvrage_tax_totals()
 
-    def _check_and_create_specific_bom(self, line):
+    def _get_ouvrage_tax_totals(self):
         """
-        Check if the current components roughly match the BoM structure.
-        If not, create a new specific BoM.
+        Returns the tax totals summary of the order, Ouvrage lines excluded.
+        Both _compute_amounts and _compute_tax_totals need it in the same recompute, so
+        the summary is memoized for the transaction, keyed on the values it depends on.
         """
-        if not line.ouvrage_line_ids:
-            return
+        self.ensure_one()
+        # Filter out Ouvrage lines
+        order_lines = self.order_line.filtered(lambda x: not x.display_type and not x.is_ouvrage)
+
+        use_cache = not self.env.context.get('sale_ouvrage_no_tax_cache')
+        if use_cache:
+            cache = get_transaction_cache(self.env, TAX_TOTALS_CACHE_KEY)
+            # Line subtotals and totals reflect quantities, prices and discounts, but not which
+            # taxes of the same rate apply, nor the rate of the date for company currency amounts.
+            # The summary holds translated labels: it depends on the language too.
+            key = (
+                self.env.lang,
+                self.currency_id.id,
+                self.currency_rate,
+                self.company_id.id,
+                self.payment_term_id.id,
+                tuple(
+                    (line.id, line.price_subtotal, line.price_total, tuple(line.tax_ids.ids))
+                    for line in order_lines
+                ),
+            )
+            cached = cache.get(self.id)
+            if cached and cached[0] == key:
+                # Callers may alter the summary: never hand out the cached one
+                return copy.deepcopy(cached[1])
 
-        is_modified = False
-        bom = line.bom_id
+        AccountTax = self.env['account.tax']
+        base_lines = [line._prepare_base_line_for_taxes_computation() for line in order_lines]
+        base_lines += self._add_base_lines_for_early_payment_discount()
         
-        # Simple check: Count of lines vs BoM lines
-        if len(line.ouvrage_line_ids) != len(bom.bom_line_ids):
-            is_modified = True
-        else:
-            # Check quantities ratio
-            bom_ratios = {}
-            for bl in bom.bom_line_ids:
-                bom_ratios[bl.product_id.id] = bl.product_qty / (bom.product_qty or 1.0)
-            
-            for child in line.ouvrage_line_ids:
-                ratio = child.product_uom_qty / (line.product_uom_qty or 1.0)
-                target_ratio = bom_ratios.get(child.product_id.id)
-                if target_ratio is None:
-                    is_modified = True # Extra component
-                    break
-                if abs(ratio - target_ratio) > 0.001:
-                    is_modified = True
-                    break
+        AccountTax._add_tax_details_in_base_lines(base_lines, self.company_id)
+        AccountTax._round_base_lines_tax_details(base_lines, self.company_id)
         
-        if is_modified:
-            # Create new BoM
-            # Naming format: Order Name + Date + Customer
-            date_str = line.order_id.date_order.strftime('%Y-%m-%d') if line.order_id.date_order else ''
-            new_code = f"{line.order_id.name} - {date_str} - {line.order_id.partner_id.name}"
-            
-            new_bom = bom.copy({
-                'code': new_code,
-                'product_tmpl_id': line.product_id.product_tmpl_id.id,
-                'bom_line_ids': False, # Clean lines to recreate them
-                'sequence': 9999, # Push to bottom as requested
-            })
-            
-            # Create new lines
-            new_bom_lines = []
-            for child in line.ouvrage_line_ids:
-                new_bom_lines.append((0, 0, {
-                    'product_id': child.product_id.id,
-                    'product_qty': child.product_uom_qty / (line.product_uom_qty or 1.0),
-                    'product_uom_id': child.product_uom.id if hasattr(child, 'product_uom') else child.product_uom_id.id if hasattr(child, 'product_uom_id') else False,
-                }))
-            
-            new_bom.write({'bom_line_ids': new_bom_lines})
-            
-            # Link line to new BoM
-            line.write({'bom_id': new_bom.id})
+        tax_totals = AccountTax._get_tax_totals_summary(
+            base_lines=base_lines,
+            currency=self.currency_id or self.company_id.currency_id,
+            company=self.company_id,
+        )
+        if use_cache:
+            cache[self.id] = (key, copy.deepcopy(tax_totals))
+        return tax_totals
+
+    @api.model
+    def _drop_ouvrage_tax_totals_cache(self):
+        self.env.cr.cache.pop(TAX_TOTALS_CACHE_KEY, None)
+
+    def _check_and_create_specific_bom(self, lines):
+        """
+        Check if the current components of the Ouvrage lines match their BoM structure.
+        If not, link them to a specific BoM with the same structure: an existing BoM with
+        the same structure signature is reused, the missing ones are created in batch.
+        """
+        with self.env['sale.ouvrage.operation.log']._profile('specific_bom', lines):
+            Bom = self.env['mrp.bom']
+            lines_by_key = {}
+            structures_by_key = {}
+            for line in lines:
+                structure = line._get_ouvrage_bom_structure()
+                if not structure:
+                    continue
+                if line._ouvrage_structure_matches_bom(structure):
+                    continue
+                signature = Bom._get_ouvrage_signature(structure)
+                key = (line.product_id.product_tmpl_id.id, signature)
+                lines_by_key.setdefault(key, self.env['sale.order.line'])
+                lines_by_key[key] |= line
+                structures_by_key.setdefault(key, structure)
+
+            # Structures captured at confirmation are now consumed
+            pending_lines = lines.filtered('ouvrage_bom_pending')
+            if pending_lines:
+                pending_lines.with_context(skip_ouvrage_price_update=True).write({
+                    'ouvrage_bom_pending': False,
+                    'ouvrage_bom_snapshot': False,
+                })
+
+            if not lines_by_key:
+                return
+
+            # Reuse the BoMs already having the same structure
+            boms_by_key = {}
+            existing_boms = Bom.search([
+                ('ouvrage_signature', 'in', [signature for _tmpl_id, signature in lines_by_key]),
+                ('product_tmpl_id', 'in', [tmpl_id for tmpl_id, _signature in lines_by_key]),
+            ])
+            for bom in existing_boms:
+                boms_by_key.setdefault((bom.product_tmpl_id.id, bom.ouvrage_signature), bom)
+
+            # Create the missing ones
+            missing_keys = [key for key in lines_by_key if key not in boms_by_key]
+            new_bom_vals = []
+            for key in missing_keys:
+                line = lines_by_key[key][0]
+                # Naming format: Order Name + Date + Customer
+                date_str = line.order_id.date_order.strftime('%Y-%m-%d') if line.order_id.date_order else ''
+                new_code = f"{line.order_id.name} - {date_str} - {line.order_id.partner_id.name}"
+                new_bom_vals += line.bom_id.copy_data({
+                    'code': new_code,
+                    'product_tmpl_id': key[0],
+                    'product_qty': 1.0, # Lines are expressed per unit of Ouvrage
+                    'bom_line_ids': [(0, 0, {
+                        'product_id': product_id,
+                        'product_qty': ratio,
+                        'product_uom_id': uom_id,
+                    }) for product_id, ratio, uom_id in structures_by_key[key]],
+                    'sequence': 9999, # Push to bottom as requested
+                    'ouvrage_is_specific': True,
+                    'ouvrage_sale_line_id': line.id,
+                })
+            if new_bom_vals:
+                boms_by_key.update(zip(missing_keys, Bom.create(new_bom_vals)))
+
+            # Link lines to their specific BoM
+            for key, key_lines in lines_by_key.items():
+                key_lines.with_context(skip_ouvrage_price_update=True).write({'bom_id': boms_by_key[key].id})
+
+    def _import_ouvrage_lines(self, rows, chunk_size=500, progress=None):
+        """
+        Imports lines of a bill of quantities in the order. `rows` is an iterable of
+        (row_number, {'reference', 'quantity', 'description', 'price_unit'}) pairs, consumed
+        chunk by chunk so that memory stays bounded whatever the size of the file.
+        Products are resolved and rows validated for the whole chunk at once, then the lines
+        of a chunk, with their components, are created in one batch. Only the lines are
+        written after each chunk: the order totals are computed once at the end.
+        `progress` is called after each chunk with the result so far.
+        Returns {'processed': number of rows read, 'created': number of imported rows,
+        'errors': [(row_number, message)]}.
+        """
+        self.ensure_one()
+        result = {'processed': 0, 'created': 0, 'errors': []}
+        SaleOrderLine = self.env['sale.order.line']
+        sequence = max(self.order_line.mapped('sequence'), default=10)
+        # Write the pending changes once: rolling back the cache of a failed row must not lose them
+        self.env.flush_all()
+        for chunk in split_every(chunk_size, rows):
+            vals_list, row_numbers = [], []
+            references = {str(values.get('reference') or '').strip() for _row_number, values in chunk}
+            products = self.env['product.product'].search([('default_code', 'in', list(references))])
+            products_by_code = {}
+            for product in products:
+                products_by_code.setdefault(product.default_code, product)
+
+            for row_number, values in chunk:
+                reference = str(values.get('reference') or '').strip()
+                product = products_by_code.get(reference)
+                if not product:
+                    result['errors'].append((row_number, f"Produit inconnu : {reference}"))
+                    continue
+                # Rejected here rather than by the batched create, which would fall back to row by row
+                if not product.sale_ok:
+                    result['errors'].append((row_number, f"Le produit {reference} ne peut pas être vendu"))
+                    continue
+                if product.company_id and product.company_id != self.company_id:
+                    result['errors'].append((row_number, f"Le produit {reference} appartient à une autre société"))
+                    continue
+                try:
+                    quantity = float(str(values.get('quantity') or 0).replace(',', '.'))
+                    price_unit = values.get('price_unit')
+                    price_unit = float(str(price_unit).replace(',', '.')) if price_unit not in (None, '') else None
+                except ValueError:
+                    result['errors'].append((row_number, "Quantité ou prix invalide"))
+                    continue
+                if quantity <= 0:
+                    result['errors'].append((row_number, "La quantité doit être positive"))
+                    continue
+
+                # Leave room for the components right after their Ouvrage
+                sequence += 2
+                vals = {
+                    'order_id': self.id,
+                    'product_id': product.id,
+                    'product_uom_qty': quantity,
+                    'sequence': sequence,
+                }
+                if values.get('description'):
+                    vals['name'] = str(values['description'])
+                if price_unit is not None:
+                    vals['price_unit'] = price_unit
+                vals_list.append(vals)
+                row_numbers.append(row_number)
+
+            result['created'] += self._import_ouvrage_create_chunk(vals_list, row_numbers, result['errors'])
+            result['processed'] += len(chunk)
+            _logger.info("Ouvrage import in %s: %s rows processed, %s errors", self.name, result['processed'], len(result['errors']))
+            if progress:
+                progress(result)
+
+            # Keep memory bounded: write the lines and drop them from the cache. The order
+            # fields are not flushed, so that its totals are only computed once.
+            SaleOrderLine.flush_model()
+            SaleOrderLine.invalidate_model()
+
+        SaleOrderLine._process_ouvrage_reprice_queue()
+        self.env.flush_all()
+        return result
+
+    def _import_ouvrage_create_chunk(self, vals_list, row_numbers, errors):
+        """
+        Creates the lines of a chunk in batch, falling back to row by row creation on error.
+        Savepoints do not flush: only the created lines are written inside them, the order
+        totals are left to the end of the import.
+        """
+        if not vals_list:
+            return 0
+        SaleOrderLine = self.env['sale.order.line']
+        SaleOrderLine.flush_model()
+        try:
+            with self.env.cr.savepoint(flush=False):
+                SaleOrderLine.create(vals_list)
+                SaleOrderLine.flush_model()
+            return len(vals_list)
+        except (exceptions.UserError, exceptions.ValidationError):
+            self._import_ouvrage_discard_rollback()
+
+        created = 0
+        for vals, row_number in zip(vals_list, row_numbers):
+            try:
+                with self.env.cr.savepoint(flush=False):
+                    SaleOrderLine.create(vals)
+                    SaleOrderLine.flush_model()
+                created += 1
+            except (exceptions.UserError, exceptions.ValidationError) as e:
+                self._import_ouvrage_discard_rollback()
+                errors.append((row_number, str(e)))
+        return created
+
+    def _import_ouvrage_discard_rollback(self):
+        """
+        Forgets the records of a rolled back savepoint. Everything else was written before the
+        savepoint, so only the values cached inside it are dropped; the order totals pending for
+        the lines already imported are marked to compute again.
+        """
+        self.env.invalidate_all(flush=False)
+        self.modified(['order_line'])
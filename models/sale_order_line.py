@@ -1,4 +1,16 @@
+import logging
+import threading
+
 from odoo import models, fields, api, _
+from odoo.tools import SQL, float_compare, float_round
+
+from .sale_order import OUVRAGE_TREE_LINE_FIELDS
+
+_logger = logging.getLogger(__name__)
+
+REPRICE_QUEUE_KEY = 'sale_ouvrage_reprice'
+REPRICE_LAST_ORDER_PARAM = 'sale_ouvrage.reprice_last_order_id'
+
 
 class SaleOrderLine(models.Model):
     _inherit = 'sale.order.line'
@@ -6,25 +18,61 @@ class SaleOrderLine(models.Model):
     is_ouvrage = fields.Boolean(related='product_id.is_ouvrage', string="Est un ouvrage", readonly=True)
     ouvrage_parent_line_id = fields.Many2one('sale.order.line', string="Ligne Ouvrage Parente", ondelete='cascade')
     ouvrage_line_ids = fields.One2many('sale.order.line', 'ouvrage_parent_line_id', string="Composants de l'ouvrage")
+    # Quantity of the component for one unit of its Ouvrage, used to scale the components
+    ouvrage_qty_per_unit = fields.Float(
+        string="Quantité par unité d'ouvrage",
+        compute='_compute_ouvrage_qty_per_unit', store=True, readonly=False, copy=True)
+    # Date of the component price, compared with the product price date to find stale quotations
+    ouvrage_price_date = fields.Datetime(string="Date du prix du composant", default=fields.Datetime.now, copy=False)
     
     # Fields from BoM
     hide_prices = fields.Boolean(string="Masquer les prix")
     hide_structure = fields.Boolean(string="Masquer la structure")
     bom_id = fields.Many2one('mrp.bom', string="Nomenclature")
+    # Structure captured at confirmation, waiting for its specific BoM (deferred generation)
+    ouvrage_bom_snapshot = fields.Json(string="Structure à matérialiser", copy=False)
+    ouvrage_bom_pending = fields.Boolean(string="Nomenclature spécifique en attente", copy=False, index=True)
+
+    # Display in customer documents (reports and portal), from the flags of the parent Ouvrage
+    ouvrage_visible_in_documents = fields.Boolean(
+        string="Visible dans les documents", compute='_compute_ouvrage_document_flags', store=True, index=True)
+    ouvrage_prices_hidden = fields.Boolean(
+        string="Prix masqués", compute='_compute_ouvrage_document_flags', store=True)
 
     # Metrics for Ouvrage/Components
     ouvrage_margin = fields.Monetary(string="Marge", compute='_compute_ouvrage_margin', store=True)
     ouvrage_margin_pct = fields.Float(string="Marge %", compute='_compute_ouvrage_margin', store=True)
 
+    @api.depends('ouvrage_parent_line_id')
+    def _compute_ouvrage_qty_per_unit(self):
+        for line in self:
+            parent = line.ouvrage_parent_line_id
+            if parent and parent.product_uom_qty:
+                line.ouvrage_qty_per_unit = line.product_uom_qty / parent.product_uom_qty
+            else:
+                line.ouvrage_qty_per_unit = 0.0
+
+    @api.depends('ouvrage_parent_line_id.hide_structure', 'ouvrage_parent_line_id.hide_prices')
+    def _compute_ouvrage_document_flags(self):
+        for line in self:
+            parent = line.ouvrage_parent_line_id
+            line.ouvrage_visible_in_documents = not parent.hide_structure
+            line.ouvrage_prices_hidden = parent.hide_prices
+
     @api.depends('price_subtotal', 'purchase_price', 'ouvrage_line_ids.price_subtotal', 'ouvrage_line_ids.purchase_price')
     def _compute_ouvrage_margin(self):
+        # Cost of the components of all the saved Ouvrages at once
+        costs = self.filtered(lambda l: l.is_ouvrage and l.id)._get_ouvrage_components_cost()
         for line in self:
             if line.is_ouvrage:
                 # Margin for Ouvrage is sum of margins (or Price - Cost)
                 # But typically margin is Price - Cost.
                 # Cost of Ouvrage = Sum(Cost of components)
                 # Price of Ouvrage = Sum(Price of components)
-                current_cost = sum(child.purchase_price * child.product_uom_qty for child in line.ouvrage_line_ids)
+                if line.id:
+                    current_cost = costs.get(line.id, 0.0)
+                else:
+                    current_cost = sum(child.purchase_price * child.product_uom_qty for child in line.ouvrage_line_ids)
                 current_price = line.price_subtotal 
                 # Note: price_subtotal is Unit Price * Qty usually, but for Ouvrage, Unit Price is sum of components unit prices.
                 
@@ -37,122 +85,509 @@ class SaleOrderLine(models.Model):
                 line.ouvrage_margin = line.margin
                 line.ouvrage_margin_pct = line.margin_percent
 
+    def _get_ouvrage_tree_values(self):
+        """ Returns the values of the line in the Ouvrage tree API """
+        self.ensure_one()
+        return {
+            'id': self.id,
+            'sequence': self.sequence,
+            'display_type': self.display_type or False,
+            'name': self.name,
+            'product_id': self.product_id.id,
+            'product_name': self.product_id.display_name,
+            'quantity': self.product_uom_qty,
+            'uom': self.product_uom_id.name,
+            'qty_per_unit': self.ouvrage_qty_per_unit,
+            'price_unit': self.price_unit,
+            'discount': self.discount,
+            'price_subtotal': self.price_subtotal,
+            'price_total': self.price_total,
+            'cost': self.purchase_price,
+            'is_ouvrage': self.is_ouvrage,
+            'bom_id': self.bom_id.id,
+            'hide_prices': self.hide_prices,
+            'hide_structure': self.hide_structure,
+            'margin': self.ouvrage_margin,
+            'margin_percent': self.ouvrage_margin_pct,
+            # Effect of the flags of the parent Ouvrage on customer documents
+            'visible_in_documents': self.ouvrage_visible_in_documents,
+            'prices_hidden': self.ouvrage_prices_hidden,
+            'write_date': fields.Datetime.to_string(self.write_date),
+        }
+
+    def read_ouvrage_components(self, offset=0, limit=None):
+        """
+        Returns a batch of the components of the Ouvrage, for the order form which only loads
+        the top-level lines: {'records': [values of the components], 'length': number of components}.
+        """
+        self.ensure_one()
+        self.check_access('read')
+        domain = [('ouvrage_parent_line_id', '=', self.id)]
+        components = self.search_fetch(domain, OUVRAGE_TREE_LINE_FIELDS, offset=offset, limit=limit, order='sequence, id')
+        length = offset + len(components)
+        if limit and len(components) == limit:
+            length = self.search_count(domain)
+        return {
+            'records': [component._get_ouvrage_tree_values() for component in components],
+            'length': length,
+        }
+
+    def _get_ouvrage_components_cost(self):
+        """ Returns {ouvrage_line_id: sum of the cost of its components}, in one grouped query """
+        if not self:
+            return {}
+        self.flush_model(['ouvrage_parent_line_id', 'purchase_price', 'product_uom_qty'])
+        self.env.cr.execute(SQL("""
+            SELECT ouvrage_parent_line_id, SUM(COALESCE(purchase_price, 0) * COALESCE(product_uom_qty, 0))
+              FROM sale_order_line
+             WHERE ouvrage_parent_line_id IN %s
+          GROUP BY ouvrage_parent_line_id
+        """, tuple(self.ids)))
+        return dict(self.env.cr.fetchall())
+
+    def _recompute_ouvrage_margin(self):
+        """ Recomputes the margin of the Ouvrages in self in batch, e.g. after a bulk cost update """
+        lines = self.filtered('is_ouvrage')
+        self.env.add_to_compute(self._fields['ouvrage_margin'], lines)
+        self.env.add_to_compute(self._fields['ouvrage_margin_pct'], lines)
+        lines.flush_recordset(['ouvrage_margin', 'ouvrage_margin_pct'])
+
     @api.onchange('product_id')
     def _onchange_product_id_ouvrage(self):
         if self.product_id and self.product_id.is_ouvrage:
             # Find BoM
-            bom = self.env['mrp.bom'].search([('product_tmpl_id', '=', self.product_id.product_tmpl_id.id)], limit=1)
-            if bom:
-                self.bom_id = bom.id
-                self.hide_prices = bom.hide_prices
-                self.hide_structure = bom.hide_structure
+            template = self.product_id.product_tmpl_id
+            bom_values = self.env['mrp.bom']._get_ouvrage_bom_values(template).get(template.id)
+            if bom_values:
+                self.bom_id = bom_values['bom_id']
+                self.hide_prices = bom_values['hide_prices']
+                self.hide_structure = bom_values['hide_structure']
                 
-                # Calculate initial price from BoM
-                price = 0.0
-                for bom_line in bom.bom_line_ids:
-                    price += bom_line.product_id.list_price * bom_line.product_qty
-                self.price_unit = price
+                # Initial price from BoM, through the order pricelist when there is one
+                bom = self.env['mrp.bom'].browse(bom_values['bom_id'])
+                price = self._get_ouvrage_pricelist_prices([(self.order_id, bom, self.product_uom_qty)])[0]
+                self.price_unit = bom_values['price'] if price is None else price
+
+    @api.model
+    def _get_ouvrage_pricelist_prices(self, requests):
+        """
+        Prices Ouvrages from their components, through the pricelist of their order.
+        `requests` are (order, bom, ouvrage quantity) triplets; returns the unit price of each
+        Ouvrage, or None when its order has no pricelist. The components of all the requests
+        are priced in one batch per pricelist.
+        """
+        def component_quantities(bom, quantity):
+            return [(product, ratio, ratio * (quantity or 1.0)) for product, ratio, _uom, _depth in bom._get_ouvrage_explosion()]
+
+        pairs_by_pricelist = {}
+        for order, bom, quantity in requests:
+            if order.pricelist_id:
+                pairs = pairs_by_pricelist.setdefault((order.pricelist_id, order.date_order), set())
+                pairs.update((product, qty) for product, _ratio, qty in component_quantities(bom, quantity))
+
+        component_prices = {
+            (pricelist, date): pricelist._get_ouvrage_component_prices(pairs, date=date)
+            for (pricelist, date), pairs in pairs_by_pricelist.items()
+        }
+
+        prices = []
+        for order, bom, quantity in requests:
+            if not order.pricelist_id:
+                prices.append(None)
+                continue
+            pricelist_prices = component_prices[(order.pricelist_id, order.date_order)]
+            prices.append(sum(
+                ratio * pricelist_prices[(product.id, qty)]
+                for product, ratio, qty in component_quantities(bom, quantity)
+            ))
+        return prices
 
     def action_configure_ouvrage(self):
         self.ensure_one()
+        # The wizard is saved with all its components in one batch before being opened,
+        # so the client only loads the visible page of components and sends back the
+        # rows that were edited instead of the whole grid
+        wizard = self.env['sale.ouvrage.configurator'].with_context(
+            default_sale_line_id=self.id,
+        ).create({})
         return {
             'type': 'ir.actions.act_window',
             'name': 'Configuration Ouvrage',
             'res_model': 'sale.ouvrage.configurator',
+            'res_id': wizard.id,
             'view_mode': 'form',
             'target': 'new',
-            'context': {
-                'default_sale_line_id': self.id,
-                'default_qty': self.product_uom_qty,
-            }
         }
 
     def write(self, values):
-        # Handle Scaling
-        if 'product_uom_qty' in values and len(self) == 1 and self.is_ouvrage:
-            old_qty = self.product_uom_qty
+        scaled_lines = edited_components = self.browse()
+        if 'product_uom_qty' in values:
             new_qty = values['product_uom_qty']
-            if old_qty != 0 and new_qty != old_qty:
-                ratio = new_qty / old_qty
-                # Scale components
-                for child in self.ouvrage_line_ids:
-                    new_child_qty = child.product_uom_qty * ratio
-                    child.write({'product_uom_qty': new_child_qty})
+            scaled_lines = self.filtered(lambda l: l.is_ouvrage and l.product_uom_qty != new_qty)
+            if not self.env.context.get('ouvrage_scaling') and 'ouvrage_qty_per_unit' not in values:
+                edited_components = self.filtered('ouvrage_parent_line_id')
         
         res = super().write(values)
+
+        # Handle Scaling: components keep their quantity per unit of Ouvrage
+        if scaled_lines:
+            scaled_lines._scale_ouvrage_components()
+
+        # A component quantity set by hand defines its new quantity per unit of Ouvrage
+        for parent, components in edited_components.grouped('ouvrage_parent_line_id').items():
+            if parent.product_uom_qty:
+                components.write({'ouvrage_qty_per_unit': values['product_uom_qty'] / parent.product_uom_qty})
         
-        # Trigger price recompute if components changed
+        # Queue a price recompute of the Ouvrages and of the Ouvrages of the components.
         # This is a fallback if onchanges didn't catch it
-        if self.is_ouvrage and not self.env.context.get('skip_ouvrage_price_update'):
-             self._recompute_ouvrage_price()
+        if not self.env.context.get('skip_ouvrage_price_update'):
+            (self.filtered('is_ouvrage') | self.ouvrage_parent_line_id)._mark_ouvrage_price_dirty()
              
         return res
 
-    def _recompute_ouvrage_price(self):
+    def unlink(self):
+        if not self.env.context.get('skip_ouvrage_price_update'):
+            (self.ouvrage_parent_line_id - self)._mark_ouvrage_price_dirty()
+        return super().unlink()
+
+    def _scale_ouvrage_components(self):
+        """
+        Sets the quantity of the components of the Ouvrages in self from their quantity
+        per unit of Ouvrage, with a single UPDATE for all the components of quotations.
+        Components of confirmed orders go through the ORM, which launches their procurements.
+        """
+        with self.env['sale.ouvrage.operation.log']._profile('scale', self):
+            digits = self._fields['product_uom_qty'].get_digits(self.env)[1]
+            quantities = {}
+            for line in self:
+                for child in line.ouvrage_line_ids:
+                    qty = float_round(child.ouvrage_qty_per_unit * line.product_uom_qty, precision_digits=digits)
+                    if float_compare(child.product_uom_qty, qty, precision_digits=digits):
+                        quantities[child] = qty
+            if not quantities:
+                return
+
+            Line = self.env['sale.order.line'].with_context(ouvrage_scaling=True, skip_ouvrage_price_update=True)
+            children = Line.concat(*quantities)
+            confirmed = children.filtered(lambda l: l.state == 'sale')
+            components_by_qty = {}
+            for child in confirmed:
+                components_by_qty.setdefault(quantities[child], []).append(child.id)
+            for qty, child_ids in components_by_qty.items():
+                Line.browse(child_ids).write({'product_uom_qty': qty})
+
+            quotation_lines = children - confirmed
+            if not quotation_lines:
+                return
+            quotation_lines.flush_recordset(['product_uom_qty'])
+            self.env.cr.execute(SQL("""
+                UPDATE sale_order_line line
+                   SET product_uom_qty = scaled.qty,
+                       write_uid = %s,
+                       write_date = (now() at time zone 'UTC')
+                  FROM (VALUES %s) AS scaled(id, qty)
+                 WHERE line.id = scaled.id
+            """, self.env.uid, SQL(", ").join(
+                SQL("(%s, %s::numeric)", child.id, quantities[child]) for child in quotation_lines
+            )))
+            quotation_lines.invalidate_recordset(['product_uom_qty', 'write_uid', 'write_date'])
+            # Prices, taxes and order totals depending on the quantities get recomputed
+            quotation_lines.modified(['product_uom_qty'])
+
+    def _get_ouvrage_structure(self):
+        """ Returns the components of the Ouvrage as (product_id, quantity per unit, uom_id) triplets """
+        self.ensure_one()
+        return [
+            (child.product_id.id, child.ouvrage_qty_per_unit, child.product_uom_id.id)
+            for child in self.ouvrage_line_ids
+        ]
+
+    def _get_ouvrage_bom_structure(self):
+        """ Structure for the specific BoM: the one captured at confirmation if pending, else the current one """
+        self.ensure_one()
+        if self.ouvrage_bom_pending:
+            return [tuple(item) for item in self.ouvrage_bom_snapshot or []]
+        return self._get_ouvrage_structure()
+
+    def _ouvrage_structure_matches_bom(self, structure):
+        """ Returns whether the structure is the one of the BoM of the Ouvrage, nested Ouvrages flattened """
+        self.ensure_one()
+        return bool(self.bom_id) and (
+            self.env['mrp.bom']._get_ouvrage_signature(structure) == self.bom_id._get_ouvrage_explosion_signature()
+        )
+
+    def _snapshot_ouvrage_structure(self):
+        """
+        Captures the structure of the customized Ouvrages in self, so that their specific
+        BoM can be generated later without depending on later edits of the components.
+        """
         for line in self:
-            if not line.ouvrage_line_ids:
+            structure = line._get_ouvrage_structure()
+            if not structure or line._ouvrage_structure_matches_bom(structure):
                 continue
-            total_price = sum(child.price_subtotal for child in line.ouvrage_line_ids)
-            # price_unit should be total / line.qty
-            if line.product_uom_qty:
-                new_unit_price = total_price / line.product_uom_qty
-                if abs(line.price_unit - new_unit_price) > 0.01:
-                    line.with_context(skip_ouvrage_price_update=True).write({'price_unit': new_unit_price})
+            line.with_context(skip_ouvrage_price_update=True).write({
+                'ouvrage_bom_snapshot': structure,
+                'ouvrage_bom_pending': True,
+            })
+
+    def _materialize_ouvrage_boms(self):
+        """ Generates the specific BoMs of the pending Ouvrages in self """
+        pending_lines = self.filtered('ouvrage_bom_pending')
+        if pending_lines:
+            self.env['sale.order']._check_and_create_specific_bom(pending_lines)
+
+    @api.model
+    def _cron_materialize_ouvrage_boms(self, batch_size=200):
+        """ Generates the specific BoMs captured at confirmation, with a commit per batch """
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        while True:
+            lines = self.search([('ouvrage_bom_pending', '=', True)], limit=batch_size, order='id')
+            if not lines:
+                break
+            lines._materialize_ouvrage_boms()
+            if auto_commit:
+                self.env.cr.commit()
+
+    def _action_launch_stock_rule(self, *args, **kwargs):
+        # Manufacturing uses the specific BoMs: generate them first when they are pending
+        self.filtered(lambda l: l.ouvrage_bom_pending and l._ouvrage_is_manufactured())._materialize_ouvrage_boms()
+        return super()._action_launch_stock_rule(*args, **kwargs)
+
+    def _ouvrage_is_manufactured(self):
+        self.ensure_one()
+        routes = self.product_id.route_ids | self.product_id.categ_id.total_route_ids
+        return 'manufacture' in routes.rule_ids.mapped('action')
+
+    def _mark_ouvrage_price_dirty(self):
+        """
+        Queues the Ouvrages in self for a price recompute. The queue is processed once,
+        in batch, when the order is saved or before the transaction is committed, so that
+        editing many components of the same Ouvrage reprices it only once.
+        """
+        ids = [line_id for line_id in self.ids if line_id]
+        if not ids:
+            return
+        queue = self.env.cr.precommit.data.get(REPRICE_QUEUE_KEY)
+        if queue is None:
+            queue = self.env.cr.precommit.data[REPRICE_QUEUE_KEY] = set()
+            self.env.cr.precommit.add(self._process_ouvrage_reprice_queue)
+        queue.update(ids)
+
+    @api.model
+    def _process_ouvrage_reprice_queue(self):
+        """ Reprices the Ouvrages queued by _mark_ouvrage_price_dirty """
+        queue = self.env.cr.precommit.data.pop(REPRICE_QUEUE_KEY, None)
+        if queue:
+            self.browse(queue).exists()._recompute_ouvrage_price()
+            # Precommit hooks run after the flush of the ORM: write the new prices and the
+            # order totals depending on them, or they would be lost at commit
+            self.env.flush_all()
+
+    def _recompute_ouvrage_price(self):
+        with self.env['sale.ouvrage.operation.log']._profile('reprice', self):
+            lines = self.filtered('ouvrage_line_ids')
+            if not lines:
+                return
+            # Subtotal of the components of all the Ouvrages in one grouped query
+            totals = dict(self.env['sale.order.line']._read_group(
+                [('ouvrage_parent_line_id', 'in', lines.ids)],
+                ['ouvrage_parent_line_id'],
+                ['price_subtotal:sum'],
+            ))
+            for line in lines:
+                total_price = totals.get(line, 0.0)
+                # price_unit should be total / line.qty
+                if line.product_uom_qty:
+                    new_unit_price = total_price / line.product_uom_qty
+                    if abs(line.price_unit - new_unit_price) > 0.01:
+                        line.with_context(skip_ouvrage_price_update=True).write({'price_unit': new_unit_price})
+
+    def copy_data(self, default=None):
+        vals_list = super().copy_data(default)
+        if self.env.context.get('sale_ouvrage_copy'):
+            # Copied Ouvrage trees keep their prices, as they are not repriced
+            for line, vals in zip(self, vals_list):
+                if line.is_ouvrage or line.ouvrage_parent_line_id:
+                    vals.setdefault('price_unit', line.price_unit)
+        return vals_list
 
     @api.model_create_multi
     def create(self, vals_list):
+        if self.env.context.get('sale_ouvrage_copy'):
+            # Copied Ouvrage trees already have their components, see SaleOrder.copy
+            return super().create(vals_list)
+
         # 1. Ensure BoM is found for Ouvrage lines if not set
-        for vals in vals_list:
-            if vals.get('product_id'):
+        products = self.env['product.product'].browse([
+            vals['product_id'] for vals in vals_list if vals.get('product_id') and not vals.get('bom_id')
+        ])
+        ouvrage_templates = products.filtered('is_ouvrage').product_tmpl_id
+        bom_values_by_template = self.env['mrp.bom']._get_ouvrage_bom_values(ouvrage_templates)
+        if bom_values_by_template:
+            to_price = []
+            for vals in vals_list:
+                if not vals.get('product_id') or vals.get('bom_id'):
+                    continue
                 product = self.env['product.product'].browse(vals['product_id'])
-                if product.is_ouvrage and not vals.get('bom_id'):
-                    bom = self.env['mrp.bom'].search([('product_tmpl_id', '=', product.product_tmpl_id.id)], limit=1)
-                    if bom:
-                        vals['bom_id'] = bom.id
-                        vals['hide_prices'] = bom.hide_prices
-                        vals['hide_structure'] = bom.hide_structure
-                        # Calculate price from BoM if not set
-                        if 'price_unit' not in vals:
-                            price = 0.0
-                            for bom_line in bom.bom_line_ids:
-                                price += bom_line.product_id.list_price * bom_line.product_qty
-                            vals['price_unit'] = price
+                bom_values = bom_values_by_template.get(product.product_tmpl_id.id)
+                if bom_values:
+                    vals['bom_id'] = bom_values['bom_id']
+                    vals['hide_prices'] = bom_values['hide_prices']
+                    vals['hide_structure'] = bom_values['hide_structure']
+                    # Calculate price from BoM if not set
+                    if 'price_unit' not in vals:
+                        vals['price_unit'] = bom_values['price']
+                        to_price.append(vals)
+
+            # Through the order pricelist, for all the Ouvrages at once
+            prices = self._get_ouvrage_pricelist_prices([(
+                self.env['sale.order'].browse(vals.get('order_id')),
+                self.env['mrp.bom'].browse(vals['bom_id']),
+                vals.get('product_uom_qty', 1.0),
+            ) for vals in to_price])
+            for vals, price in zip(to_price, prices):
+                if price is not None:
+                    vals['price_unit'] = price
 
         lines = super().create(vals_list)
         
-        # 2. Explode
-        for line in lines:
-            if line.is_ouvrage and line.bom_id:
-                line._explode_ouvrage()
+        # 2. Explode (all ouvrages of the batch at once)
+        lines.filtered(lambda l: l.is_ouvrage and l.bom_id)._explode_ouvrage()
+
+        # 3. Components added to an existing Ouvrage change its price
+        if not self.env.context.get('skip_ouvrage_price_update'):
+            lines.ouvrage_parent_line_id._mark_ouvrage_price_dirty()
                 
         return lines
 
-    def _explode_ouvrage(self):
+    def _prepare_ouvrage_component_vals(self):
         """
-        Creates component lines from the BoM using the current Ouvrage Quantity.
-        Does NOT remove existing lines.
+        Returns the values of the component lines of this Ouvrage, based on its BoM
+        and its current quantity.
         """
         self.ensure_one()
-        if not self.is_ouvrage or not self.bom_id:
-            return
-
         lines_values = []
         factor = self.product_uom_qty or 1.0
         
-        for bom_line in self.bom_id.bom_line_ids:
-            qty = bom_line.product_qty * factor
-            name_indented = f"    > {bom_line.product_id.display_name}"
+        # Nested Ouvrages are exploded down to their components, from the flattened explosion
+        for product, ratio, uom, _depth in self.bom_id._get_ouvrage_explosion():
+            qty = ratio * factor
+            name_indented = f"    > {product.display_name}"
             
             vals = {
                 'order_id': self.order_id.id,
-                'product_id': bom_line.product_id.id,
+                'product_id': product.id,
                 'name': name_indented, # Visual Indentation
                 'product_uom_qty': qty,
-                'product_uom_id': bom_line.product_uom_id.id,
+                'product_uom_id': uom.id,
                 'ouvrage_parent_line_id': self.id,
+                'ouvrage_qty_per_unit': ratio,
                 'sequence': self.sequence + 1, 
             }
             lines_values.append(vals)
+        return lines_values
+
+    def _explode_ouvrage(self):
+        """
+        Creates component lines from the BoM using the current Ouvrage Quantity.
+        Does NOT remove existing lines.
+        The components of all the Ouvrages in self are created with a single create call,
+        so that the computed fields of the order are recomputed only once.
+        """
+        with self.env['sale.ouvrage.operation.log']._profile('explode', self):
+            lines_values = []
+            for line in self:
+                if not line.is_ouvrage or not line.bom_id:
+                    continue
+                lines_values += line._prepare_ouvrage_component_vals()
+
+            if lines_values:
+                # The Ouvrage price already comes from its BoM
+                self.env['sale.order.line'].with_context(skip_ouvrage_price_update=True).create(lines_values)
+
+    @api.model
+    def _cron_reprice_open_ouvrages(self, batch_size=50, dry_run=False):
+        """
+        Reprices the components of the draft/sent quotations whose product list price changed
+        since they were priced, then their Ouvrages. Orders are processed in chunks of
+        `batch_size`, with a commit per chunk; the last processed order is saved so that an
+        interrupted run resumes where it stopped. Orders locked by another transaction are
+        skipped and picked up by the next run.
+        With dry_run, nothing is written: returns the impact on the untaxed amount of each
+        order, as {order_id: (current amount, repriced amount)}.
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        last_order_id = 0 if dry_run else int(ICP.get_param(REPRICE_LAST_ORDER_PARAM, 0))
+        auto_commit = not dry_run and not getattr(threading.current_thread(), 'testing', False)
+        impact = {}
+        while True:
+            order_ids = self._get_ouvrage_orders_to_reprice(last_order_id, batch_size)
+            if not order_ids:
+                break
+            last_order_id = order_ids[-1]
+            if dry_run:
+                # Nothing is written: the orders are read without locking them
+                impact.update(self.env['sale.order'].browse(order_ids)._simulate_ouvrage_reprice())
+            else:
+                orders = self.env['sale.order'].browse(self._lock_ouvrage_orders(order_ids))
+                orders.order_line._reprice_stale_ouvrage_components()
+                ICP.set_param(REPRICE_LAST_ORDER_PARAM, last_order_id)
+                _logger.info("Ouvrage repricing: %s orders repriced, up to order %s", len(orders), last_order_id)
+            if auto_commit:
+                self.env.cr.commit()
+            # Keep memory bounded between chunks
+            self.env.invalidate_all()
+
+        if not dry_run:
+            # Next run starts over, to pick up the orders skipped because they were locked
+            ICP.set_param(REPRICE_LAST_ORDER_PARAM, 0)
+        else:
+            total = sum(new - old for old, new in impact.values())
+            _logger.info("Ouvrage repricing (dry run): %s orders, total impact %.2f", len(impact), total)
+        return impact
+
+    @api.model
+    def _get_ouvrage_orders_to_reprice(self, after_order_id, limit):
+        """ Returns the ids of the open orders with components priced before their product price change """
+        self.flush_model(['order_id', 'product_id', 'ouvrage_parent_line_id', 'ouvrage_price_date'])
+        self.env['sale.order'].flush_model(['state'])
+        self.env['product.template'].flush_model(['list_price_date'])
+        self.env.cr.execute(SQL("""
+            SELECT DISTINCT line.order_id
+              FROM sale_order_line line
+              JOIN sale_order so ON so.id = line.order_id
+              JOIN product_product product ON product.id = line.product_id
+              JOIN product_template tmpl ON tmpl.id = product.product_tmpl_id
+             WHERE line.ouvrage_parent_line_id IS NOT NULL
+               AND so.state IN ('draft', 'sent')
+               AND tmpl.list_price_date > line.ouvrage_price_date
+               AND line.order_id > %s
+          ORDER BY line.order_id
+             LIMIT %s
+        """, after_order_id, limit))
+        return [order_id for order_id, in self.env.cr.fetchall()]
+
+    @api.model
+    def _lock_ouvrage_orders(self, order_ids):
+        """ Locks the given orders, skipping the ones being edited, and returns the locked ids """
+        self.env.cr.execute(SQL(
+            "SELECT id FROM sale_order WHERE id IN %s ORDER BY id FOR UPDATE SKIP LOCKED",
+            tuple(order_ids),
+        ))
+        return [order_id for order_id, in self.env.cr.fetchall()]
+
+    def _reprice_stale_ouvrage_components(self):
+        """ Recomputes the price of the components in self whose product price changed, and their Ouvrages """
+        stale = self.filtered(lambda l: (
+            l.ouvrage_parent_line_id
+            and l.product_id.list_price_date
+            and (not l.ouvrage_price_date or l.product_id.list_price_date > l.ouvrage_price_date)
+        ))
+        if not stale:
+            return
+        # Same computation as the standard price update, manually set prices are kept
+        stale._compute_price_unit()
+        stale.write({'ouvrage_price_date': fields.Datetime.now()})
+        stale.ouvrage_parent_line_id._mark_ouvrage_price_dirty()
+        self._process_ouvrage_reprice_queue()
 
-        for val in lines_values:
-            self.env['sale.order.line'].create(val)
@@ -0,0 +1,105 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from odoo import models, fields, api, SUPERUSER_ID
+from odoo.tools import str2bool
+
+_logger = logging.getLogger(__name__)
+
+PROFILING_PARAM = 'sale_ouvrage.profiling'
+RETENTION_PARAM = 'sale_ouvrage.profiling_retention_days'
+LOG_BUFFER_KEY = 'sale_ouvrage_operation_logs'
+
+
+class SaleOuvrageOperationLog(models.Model):
+    _name = 'sale.ouvrage.operation.log'
+    _description = 'Instrumentation of the Ouvrage operations'
+    _order = 'duration desc, id desc'
+
+    operation = fields.Selection([
+        ('explode', "Explosion"),
+        ('scale', "Mise à l'échelle"),
+        ('reprice', "Recalcul du prix"),
+        ('amounts', "Calcul des montants"),
+        ('specific_bom', "Nomenclatures spécifiques"),
+    ], string="Opération", required=True, readonly=True)
+    order_id = fields.Many2one('sale.order', string="Commande", index=True, ondelete='cascade', readonly=True)
+    duration = fields.Float(string="Durée (ms)", digits=(16, 2), readonly=True)
+    query_count = fields.Integer(string="Requêtes SQL", readonly=True)
+    record_count = fields.Integer(string="Enregistrements", readonly=True)
+    user_id = fields.Many2one('res.users', string="Utilisateur", readonly=True)
+
+    @api.model
+    def _is_profiling_enabled(self):
+        """ Profiling is enabled by the context key or by the system parameter """
+        if 'sale_ouvrage_profiling' in self.env.context:
+            return bool(self.env.context['sale_ouvrage_profiling'])
+        return str2bool(self.env['ir.config_parameter'].sudo().get_param(PROFILING_PARAM, 'False'))
+
+    @contextmanager
+    def _profile(self, operation, records):
+        """
+        Records the duration, the SQL query count and the number of records touched by the
+        block, when profiling is enabled. `records` are sale orders or sale order lines.
+        """
+        if not records or not self._is_profiling_enabled():
+            yield
+            return
+
+        cr = self.env.cr
+        start_queries = cr.sql_log_count
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            query_count = cr.sql_log_count - start_queries
+            orders = records if records._name == 'sale.order' else records.order_id
+            order_ids = [order_id for order_id in orders._origin.ids if order_id]
+            values = {
+                'operation': operation,
+                'order_id': order_ids[0] if len(order_ids) == 1 else False,
+                'duration': duration,
+                'query_count': query_count,
+                'record_count': len(records),
+                'user_id': self.env.uid,
+            }
+            _logger.info("sale_ouvrage operation %s", json.dumps(dict(values, order_ids=order_ids)))
+            self._buffer_operation_log(values)
+
+    @api.model
+    def _buffer_operation_log(self, values):
+        """
+        Keeps the log entry until the transaction is committed: operations are profiled inside
+        computes, onchanges and flushes, where creating records is not an option. The entries
+        are written with a cursor of their own after the commit, and dropped on rollback.
+        """
+        cr = self.env.cr
+        buffer = cr.postcommit.data.get(LOG_BUFFER_KEY)
+        if buffer is None:
+            buffer = cr.postcommit.data[LOG_BUFFER_KEY] = []
+            registry = self.env.registry
+
+            @cr.postcommit.add
+            def write_operation_logs():
+                try:
+                    with registry.cursor() as log_cr:
+                        env = api.Environment(log_cr, SUPERUSER_ID, {})
+                        env['sale.ouvrage.operation.log']._create_operation_logs(buffer)
+                except Exception:
+                    _logger.exception("Could not write the sale_ouvrage operation logs")
+        buffer.append(values)
+
+    @api.model
+    def _create_operation_logs(self, values_list):
+        return self.sudo().create(values_list)
+
+    @api.autovacuum
+    def _gc_operation_logs(self):
+        """ Deletes the log entries older than the retention period (30 days by default) """
+        days = int(self.env['ir.config_parameter'].sudo().get_param(RETENTION_PARAM, 30))
+        threshold = fields.Datetime.now() - timedelta(days=days)
+        self.sudo().search([('create_date', '<', threshold)], limit=100000).unlink()
@@ -1,42 +1,82 @@
 /** @odoo-module **/
 
 import { patch } from "@web/core/utils/patch";
+import { useService } from "@web/core/utils/hooks";
+import { formatFloat } from "@web/views/fields/formatters";
 import { SaleOrderLineListRenderer } from "@sale/js/sale_order_line_field/sale_order_line_field";
-import { useSubEnv, useState } from "@odoo/owl";
+import { useState } from "@odoo/owl";
+
+// Number of components fetched at once when an Ouvrage is expanded
+const COMPONENTS_BATCH_SIZE = 80;
 
 patch(SaleOrderLineListRenderer.prototype, {
     setup() {
         super.setup();
+        this.orm = useService("orm");
         this.ouvrageState = useState({
             expandedOuvrages: new Set(),
+            // Components already loaded, by Ouvrage: {stamp, records, length, loading}
+            components: {},
         });
     },
 
-    toggleOuvrage(recordId) {
-        if (this.ouvrageState.expandedOuvrages.has(recordId)) {
-            this.ouvrageState.expandedOuvrages.delete(recordId);
-        } else {
-            this.ouvrageState.expandedOuvrages.add(recordId);
+    async toggleOuvrage(record) {
+        const ouvrageId = record.resId;
+        if (this.ouvrageState.expandedOuvrages.has(ouvrageId)) {
+            this.ouvrageState.expandedOuvrages.delete(ouvrageId);
+            return;
+        }
+        this.ouvrageState.expandedOuvrages.add(ouvrageId);
+        const subtree = this.ouvrageState.components[ouvrageId];
+        if (!subtree || subtree.stamp !== this.getOuvrageStamp(record)) {
+            await this.loadOuvrageComponents(record);
         }
     },
 
-    get rows() {
-        const rows = super.rows;
-        return rows.filter((row) => {
-            const record = row.record;
-            // ouvrage_parent_line_id: [id, name] or False
-            const parentField = record.data.ouvrage_parent_line_id;
-            // Handle both [id, name] and id (though usually array in m2o)
-            const parentId = Array.isArray(parentField) ? parentField[0] : parentField;
-
-            // If it has a parent, it is a component
-            if (parentId) {
-                // If the parent is NOT in the expanded set, hide this row
-                if (!this.ouvrageState.expandedOuvrages.has(parentId)) {
-                    return false;
-                }
-            }
-            return true;
+    /**
+     * The configurator and the repricing always write the Ouvrage line: its components are
+     * fetched again once it was saved since they were loaded.
+     */
+    getOuvrageStamp(record) {
+        return String(record.data.write_date);
+    },
+
+    async loadOuvrageComponents(record, offset = 0) {
+        const ouvrageId = record.resId;
+        const stamp = this.getOuvrageStamp(record);
+        const previous = offset ? this.ouvrageState.components[ouvrageId].records : [];
+        this.ouvrageState.components[ouvrageId] = {
+            stamp,
+            records: previous,
+            length: previous.length,
+            loading: true,
+        };
+        const result = await this.orm.call("sale.order.line", "read_ouvrage_components", [[ouvrageId]], {
+            offset,
+            limit: COMPONENTS_BATCH_SIZE,
         });
+        this.ouvrageState.components[ouvrageId] = {
+            stamp,
+            records: [...previous, ...result.records],
+            length: result.length,
+            loading: false,
+        };
+    },
+
+    loadMoreOuvrageComponents(record) {
+        const subtree = this.ouvrageState.components[record.resId];
+        return this.loadOuvrageComponents(record, subtree.records.length);
+    },
+
+    getOuvrageComponents(record) {
+        return this.ouvrageState.components[record.resId] || { records: [], length: 0, loading: true };
+    },
+
+    get ouvrageComponentColspan() {
+        return this.columns.length + 2;
+    },
+
+    formatOuvrageNumber(value) {
+        return formatFloat(value, { digits: [16, 2] });
     },
 });
@@ -1 +1,2 @@
 from . import test_sale_ouvrage
+from . import test_sale_ouvrage_benchmark
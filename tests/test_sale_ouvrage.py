@@ -1,3 +1,6 @@
+import base64
+from unittest.mock import patch
+
 from odoo.tests.common import TransactionCase
 from odoo.exceptions import ValidationError
 
@@ -108,3 +111,661 @@ class TestSaleOuvrage(TransactionCase):
         new_bom_line_b = ouvrage_line.bom_id.bom_line_ids.filtered(lambda l: l.product_id == self.component_b)
         self.assertEqual(new_bom_line_b.product_qty, 5.0, "New BoM should have Qty 5.0 for Component B")
 
+    def _create_ouvrage_with_components(self, name, count):
+        """ Creates an Ouvrage product with a BoM of `count` distinct components """
+        ouvrage = self.Product.create({
+            'name': name,
+            'type': 'consu',
+            'is_ouvrage': True,
+        })
+        components = self.Product.create([{
+            'name': f'{name} - Component {i}',
+            'type': 'consu',
+            'list_price': 10.0 + i,
+        } for i in range(count)])
+        self.Bom.create({
+            'product_tmpl_id': ouvrage.product_tmpl_id.id,
+            'product_qty': 1.0,
+            'bom_line_ids': [(0, 0, {'product_id': c.id, 'product_qty': 1.0}) for c in components],
+        })
+        return ouvrage
+
+    def test_explosion_batched(self):
+        """ Test that several Ouvrages created together are all exploded """
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        lines = self.SaleOrderLine.create([{
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': qty,
+        } for qty in (1.0, 3.0)])
+
+        self.assertEqual(len(lines[0].ouvrage_line_ids), 2)
+        self.assertEqual(len(lines[1].ouvrage_line_ids), 2)
+        comp_b = lines[1].ouvrage_line_ids.filtered(lambda l: l.product_id == self.component_b)
+        self.assertEqual(comp_b.product_uom_qty, 6.0, "3 * 2 = 6.0")
+
+    def test_explosion_query_count(self):
+        """ Test that the number of queries of the explosion does not grow with the number of components """
+        small = self._create_ouvrage_with_components('Small', 2)
+        big = self._create_ouvrage_with_components('Big', 20)
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+
+        def count_queries(product):
+            self.env.flush_all()
+            self.env.invalidate_all()
+            start = self.cr.sql_log_count
+            self.SaleOrderLine.create({
+                'order_id': so.id,
+                'product_id': product.id,
+                'product_uom_qty': 1.0,
+            })
+            self.env.flush_all()
+            return self.cr.sql_log_count - start
+
+        # Warm up caches
+        count_queries(small)
+        small_count = count_queries(small)
+        big_count = count_queries(big)
+        # 18 more components: at most a small constant number of extra queries, not one per component
+        self.assertLessEqual(big_count - small_count, 2, "Explosion should not issue queries per component")
+
+    def test_bom_values_cache(self):
+        """ Test the BoM resolution cache and its invalidation """
+        Bom = self.Bom
+        template = self.product_ouvrage.product_tmpl_id
+        values = Bom._get_ouvrage_bom_values(template)[template.id]
+        self.assertEqual(values['bom_id'], self.bom_ouvrage.id)
+        self.assertEqual(values['price'], 40.0, "2 * 10 + 1 * 20 = 40")
+
+        # Memoized: no query on a second resolution
+        start = self.cr.sql_log_count
+        Bom._get_ouvrage_bom_values(template)
+        self.assertEqual(self.cr.sql_log_count, start, "BoM values should be memoized")
+
+        # Invalidated when a component price changes
+        self.component_b.list_price = 15.0
+        self.assertEqual(Bom._get_ouvrage_bom_values(template)[template.id]['price'], 50.0)
+
+        # Invalidated when the BoM lines change
+        self.bom_ouvrage.bom_line_ids.filtered(lambda l: l.product_id == self.component_c).product_qty = 2.0
+        self.assertEqual(Bom._get_ouvrage_bom_values(template)[template.id]['price'], 70.0)
+
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        ouvrage_line = self.SaleOrderLine.create({
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': 1.0,
+        })
+        self.assertEqual(ouvrage_line.price_unit, 70.0)
+
+    def test_scaling_multi_records(self):
+        """ Test scaling several Ouvrages with a single write, without float drift """
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        lines = self.SaleOrderLine.create([{
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': qty,
+        } for qty in (1.0, 2.0)])
+
+        lines.write({'product_uom_qty': 3.0})
+        for line in lines:
+            comp_b = line.ouvrage_line_ids.filtered(lambda l: l.product_id == self.component_b)
+            self.assertEqual(comp_b.product_uom_qty, 6.0, "3 * 2 = 6.0")
+
+        # Repeated scaling relies on the quantity per unit, not on the previous quantity
+        for qty in (0.7, 1.3, 0.0, 1.1):
+            lines.write({'product_uom_qty': qty})
+        comp_c = lines[0].ouvrage_line_ids.filtered(lambda l: l.product_id == self.component_c)
+        self.assertEqual(comp_c.product_uom_qty, 1.1)
+
+        # Editing a component by hand changes its quantity per unit
+        comp_c.write({'product_uom_qty': 5.5})
+        self.assertAlmostEqual(comp_c.ouvrage_qty_per_unit, 5.0)
+        lines[0].write({'product_uom_qty': 2.0})
+        self.assertAlmostEqual(comp_c.product_uom_qty, 10.0)
+
+    def test_deferred_ouvrage_reprice(self):
+        """ Test that component edits reprice their Ouvrage once, when the queue is processed """
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        ouvrage_line = self.SaleOrderLine.create({
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': 1.0,
+        })
+        comp_b, comp_c = ouvrage_line.ouvrage_line_ids.sorted(lambda l: l.product_id != self.component_b)
+
+        comp_b.write({'price_unit': 12.0})
+        comp_c.write({'price_unit': 25.0})
+        queue = self.env.cr.precommit.data.get('sale_ouvrage_reprice')
+        self.assertEqual(queue, {ouvrage_line.id}, "The Ouvrage should be queued once")
+
+        self.SaleOrderLine._process_ouvrage_reprice_queue()
+        self.assertFalse(self.env.cr.precommit.data.get('sale_ouvrage_reprice'))
+        self.assertEqual(ouvrage_line.price_unit, 49.0, "2 * 12 + 1 * 25 = 49")
+
+        # Saving the order processes the queue
+        comp_c.write({'price_unit': 30.0})
+        so.write({'note': 'Updated'})
+        self.assertEqual(ouvrage_line.price_unit, 54.0, "2 * 12 + 1 * 30 = 54")
+
+        # Direct writes on the lines are repriced at commit, and saved in the database
+        comp_b.write({'price_unit': 15.0})
+        self.env.flush_all()
+        self.env.cr.precommit.run()
+        self.env.cr.execute("SELECT price_unit FROM sale_order_line WHERE id = %s", [ouvrage_line.id])
+        self.assertEqual(self.env.cr.fetchone()[0], 60.0, "2 * 15 + 1 * 30 = 60")
+        self.env.cr.execute("SELECT amount_untaxed FROM sale_order WHERE id = %s", [so.id])
+        self.assertEqual(self.env.cr.fetchone()[0], so.amount_untaxed)
+
+    def test_confirmation_reuses_specific_bom(self):
+        """ Test confirmation reuses a specific BoM having the same structure """
+        orders = self.SaleOrder.create([{'partner_id': self.partner.id} for _i in range(3)])
+        ouvrage_lines = self.SaleOrderLine.create([{
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': qty,
+        } for so, qty in zip(orders, (1.0, 2.0, 1.0))])
+
+        # Same modification on every order: Component B ratio is now 5:1
+        for line in ouvrage_lines:
+            comp_b = line.ouvrage_line_ids.filtered(lambda l: l.product_id == self.component_b)
+            comp_b.write({'product_uom_qty': 5.0 * line.product_uom_qty})
+
+        # Confirming several orders at once creates a single BoM
+        orders[:2].action_confirm()
+        specific_bom = ouvrage_lines[0].bom_id
+        self.assertNotEqual(specific_bom, self.bom_ouvrage)
+        self.assertEqual(ouvrage_lines[1].bom_id, specific_bom)
+
+        # A later confirmation reuses it
+        orders[2].action_confirm()
+        self.assertEqual(ouvrage_lines[2].bom_id, specific_bom)
+        self.assertEqual(self.Bom.search_count([('product_tmpl_id', '=', self.product_ouvrage.product_tmpl_id.id)]), 2)
+
+    def test_configurator_save_diff(self):
+        """ Test that saving the configurator only updates what changed """
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        ouvrage_line = self.SaleOrderLine.create({
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': 1.0,
+        })
+        children = ouvrage_line.ouvrage_line_ids
+        comp_b = children.filtered(lambda l: l.product_id == self.component_b)
+        comp_c = children - comp_b
+        comp_b.write({'price_unit': 15.0, 'discount': 5.0})
+
+        wizard = self.env['sale.ouvrage.configurator'].with_context(
+            default_sale_line_id=ouvrage_line.id,
+            default_qty=ouvrage_line.product_uom_qty,
+        ).create({})
+        wizard.component_ids.filtered(lambda c: c.product_id == self.component_b).quantity = 3.0
+        wizard.component_ids.filtered(lambda c: c.product_id == self.component_c).unlink()
+        component_d = self.Product.create({'name': 'Component D', 'type': 'consu', 'list_price': 5.0})
+        wizard.component_ids = [(0, 0, {'product_id': component_d.id, 'quantity': 4.0, 'price_unit': 5.0})]
+        wizard.action_save()
+
+        self.assertTrue(comp_b.exists(), "Changed components should be updated in place")
+        self.assertEqual(comp_b.product_uom_qty, 3.0)
+        self.assertEqual(comp_b.ouvrage_qty_per_unit, 3.0)
+        self.assertEqual((comp_b.price_unit, comp_b.discount), (15.0, 5.0), "Wizard prices should be kept")
+        self.assertTrue(comp_b.name.startswith("    > "), "The product is not written again")
+        self.assertFalse(comp_c.exists(), "Removed components should be deleted")
+        comp_d = ouvrage_line.ouvrage_line_ids.filtered(lambda l: l.product_id == component_d)
+        self.assertEqual(comp_d.product_uom_qty, 4.0)
+        self.assertEqual(len(ouvrage_line.ouvrage_line_ids), 2)
+
+    def test_document_visibility_flags(self):
+        """ Test the stored visibility flags of the components in customer documents """
+        self.bom_ouvrage.hide_structure = True
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        ouvrage_line = self.SaleOrderLine.create({
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': 1.0,
+        })
+        children = ouvrage_line.ouvrage_line_ids
+        self.assertTrue(ouvrage_line.ouvrage_visible_in_documents)
+        self.assertTrue(all(children.mapped('ouvrage_prices_hidden')), "Should follow hide_prices of the Ouvrage")
+        self.assertFalse(any(children.mapped('ouvrage_visible_in_documents')), "Should follow hide_structure of the Ouvrage")
+        self.assertEqual(so._get_order_lines_to_report(), ouvrage_line)
+
+        ouvrage_line.write({'hide_structure': False, 'hide_prices': False})
+        self.assertTrue(all(children.mapped('ouvrage_visible_in_documents')))
+        self.assertFalse(any(children.mapped('ouvrage_prices_hidden')))
+        self.assertEqual(so._get_order_lines_to_report(), ouvrage_line | children)
+
+    def test_ouvrage_margin_bulk_recompute(self):
+        """ Test the Ouvrage margin aggregated from the components costs """
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        ouvrage_lines = self.SaleOrderLine.create([{
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': 1.0,
+        } for _i in range(2)])
+        ouvrage_lines.ouvrage_line_ids.filtered(lambda l: l.product_id == self.component_b).purchase_price = 4.0
+        ouvrage_lines.ouvrage_line_ids.filtered(lambda l: l.product_id == self.component_c).purchase_price = 5.0
+
+        for line in ouvrage_lines:
+            self.assertEqual(ouvrage_lines._get_ouvrage_components_cost()[line.id], 13.0, "2 * 4 + 1 * 5 = 13")
+            self.assertAlmostEqual(line.ouvrage_margin, line.price_subtotal - 13.0)
+
+        # Bulk cost update bypassing the ORM, then maintenance action
+        self.env.flush_all()
+        self.cr.execute("UPDATE sale_order_line SET purchase_price = 1.0 WHERE id IN %s", [tuple(ouvrage_lines.ouvrage_line_ids.ids)])
+        self.env.invalidate_all()
+        so.action_recompute_ouvrage_margin()
+        for line in ouvrage_lines:
+            self.assertAlmostEqual(line.ouvrage_margin, line.price_subtotal - 3.0)
+
+    def test_operation_profiling(self):
+        """ Test that Ouvrage operations are only recorded when profiling is enabled """
+        Log = self.env['sale.ouvrage.operation.log']
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        self.SaleOrderLine.create({
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': 1.0,
+        })
+        self.assertFalse(self.env.cr.postcommit.data.get('sale_ouvrage_operation_logs'))
+
+        ouvrage_line = self.SaleOrderLine.with_context(sale_ouvrage_profiling=True).create({
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': 1.0,
+        })
+        ouvrage_line.write({'product_uom_qty': 2.0})
+        # The order totals are recomputed by the flush, with the profiling context
+        ouvrage_line.env.flush_all()
+
+        # Entries are kept until the commit, then written
+        buffer = self.env.cr.postcommit.data.get('sale_ouvrage_operation_logs')
+        self.assertEqual({values['operation'] for values in buffer}, {'explode', 'scale', 'amounts'})
+        self.assertFalse(Log.search([('order_id', '=', so.id)]))
+        logs = Log._create_operation_logs(buffer)
+        explode_log = logs.filtered(lambda l: l.operation == 'explode')
+        self.assertEqual(explode_log.record_count, 1)
+        self.assertGreater(explode_log.query_count, 0)
+
+    def test_import_bill_of_quantities(self):
+        """ Test the chunked import of a bill of quantities, with per-row errors """
+        self.product_ouvrage.default_code = 'OUV-A'
+        self.component_b.default_code = 'CMP-B'
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        content = "Référence;Quantité;Désignation\nOUV-A;2;Mur\nUNKNOWN;1;\nCMP-B;abc;\nOUV-A;1,5;\nCMP-B;3;\n"
+        wizard = self.env['sale.ouvrage.import'].create({
+            'order_id': so.id,
+            'file': base64.b64encode(content.encode()),
+            'filename': 'dpgf.csv',
+            'chunk_size': 2,
+        })
+        wizard.action_import()
+
+        self.assertEqual(wizard.row_count, 5)
+        self.assertEqual(wizard.line_count, 3)
+        self.assertIn("Ligne 3", wizard.error_log)
+        self.assertIn("Ligne 4", wizard.error_log)
+        ouvrage_lines = so.order_line.filtered('is_ouvrage')
+        self.assertEqual(ouvrage_lines.mapped('product_uom_qty'), [2.0, 1.5])
+        self.assertEqual(ouvrage_lines[0].name, "Mur")
+        self.assertEqual(len(so.order_line), 2 * 3 + 1, "2 Ouvrages with their 2 components and 1 product")
+        self.assertEqual(so.amount_untaxed, sum(so.order_line.filtered(lambda l: not l.is_ouvrage).mapped('price_subtotal')))
+
+    def test_import_failed_row_keeps_pending_writes(self):
+        """ Test that a row failing at creation does not lose the changes pending before the import """
+        self.product_ouvrage.default_code = 'OUV-A'
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        so.client_order_ref = 'REF-42'
+
+        SaleOrderLine = self.registry['sale.order.line']
+        create = SaleOrderLine.create
+
+        def failing_create(records, vals_list):
+            if any(vals.get('name') == 'Refusée' for vals in (vals_list if isinstance(vals_list, list) else [vals_list])):
+                raise ValidationError("Ligne refusée")
+            return create(records, vals_list)
+
+        rows = [
+            (2, {'reference': 'OUV-A', 'quantity': '1', 'description': 'Refusée'}),
+            (3, {'reference': 'OUV-A', 'quantity': '2', 'description': 'Mur'}),
+        ]
+        with patch.object(SaleOrderLine, 'create', failing_create):
+            result = so._import_ouvrage_lines(rows, chunk_size=2)
+
+        self.assertEqual(result['created'], 1)
+        self.assertEqual([row_number for row_number, _message in result['errors']], [2])
+        self.env.invalidate_all()
+        self.assertEqual(so.client_order_ref, 'REF-42')
+        self.assertEqual(so.order_line.filtered('is_ouvrage').name, 'Mur')
+
+    def test_cron_reprice_open_ouvrages(self):
+        """ Test the repricing of open quotations after a component price change """
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        ouvrage_line = self.SaleOrderLine.create({
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': 1.0,
+        })
+        comp_b = ouvrage_line.ouvrage_line_ids.filtered(lambda l: l.product_id == self.component_b)
+        ouvrage_line.ouvrage_line_ids.ouvrage_price_date = '2020-01-01 00:00:00'
+        self.component_b.list_price = 15.0
+        amount = so.amount_untaxed
+
+        # Dry run: impact reported, nothing written
+        impact = self.SaleOrderLine._cron_reprice_open_ouvrages(dry_run=True)
+        self.assertEqual(impact[so.id], (amount, amount + 10.0), "Component B: 2 * (15 - 10) = 10")
+        self.assertEqual(comp_b.price_unit, 10.0)
+        self.assertEqual(so.amount_untaxed, amount)
+
+        self.SaleOrderLine._cron_reprice_open_ouvrages()
+        self.assertEqual(comp_b.price_unit, 15.0)
+        self.assertEqual(ouvrage_line.price_unit, 50.0, "2 * 15 + 1 * 20 = 50")
+        self.assertEqual(so.amount_untaxed, amount + 10.0)
+
+        # Nothing left to reprice
+        self.assertFalse(self.SaleOrderLine._get_ouvrage_orders_to_reprice(0, 10))
+
+    def test_copy_order_with_ouvrages(self):
+        """ Test that duplicating a quotation copies the Ouvrage trees without exploding them again """
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        ouvrage_lines = self.SaleOrderLine.create([{
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': qty,
+        } for qty in (1.0, 2.0)])
+        ouvrage_lines[0].ouvrage_line_ids.filtered(lambda l: l.product_id == self.component_b).price_unit = 12.0
+        self.SaleOrderLine._process_ouvrage_reprice_queue()
+
+        # Lines out of their creation order are still copied with their own components
+        ouvrage_lines[1].sequence = 1
+
+        new_so = so.copy()
+        self.assertEqual(len(new_so.order_line), len(so.order_line), "Components should not be exploded again")
+        new_ouvrages = new_so.order_line.filtered('is_ouvrage').sorted('product_uom_qty')
+        for old, new in zip(ouvrage_lines, new_ouvrages):
+            self.assertEqual(new.product_uom_qty, old.product_uom_qty)
+            self.assertEqual(new.ouvrage_line_ids.ouvrage_parent_line_id, new)
+            self.assertEqual(len(new.ouvrage_line_ids), 2)
+            self.assertEqual(new.price_unit, old.price_unit)
+            self.assertEqual(new.ouvrage_line_ids.order_id, new_so)
+            self.assertEqual(sorted(new.ouvrage_line_ids.mapped('product_uom_qty')), sorted(old.ouvrage_line_ids.mapped('product_uom_qty')))
+            self.assertEqual(len(old.ouvrage_line_ids), 2, "Original Ouvrages keep their components")
+        self.assertAlmostEqual(new_ouvrages[0].ouvrage_margin, ouvrage_lines[0].ouvrage_margin)
+        new_comp_b = new_ouvrages[0].ouvrage_line_ids.filtered(lambda l: l.product_id == self.component_b)
+        self.assertEqual(new_comp_b.price_unit, 12.0, "Copied components keep their price")
+
+    def test_specific_bom_excluded_and_archived(self):
+        """ Test that order-specific BoMs are not default BoMs and get archived with their orders """
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        ouvrage_line = self.SaleOrderLine.create({
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': 1.0,
+        })
+        ouvrage_line.ouvrage_line_ids.filtered(lambda l: l.product_id == self.component_b).product_uom_qty = 5.0
+        so.action_confirm()
+        specific_bom = ouvrage_line.bom_id
+        self.assertTrue(specific_bom.ouvrage_is_specific)
+        self.assertEqual(specific_bom.ouvrage_sale_line_id, ouvrage_line)
+
+        # Even first in sequence, a specific BoM is never the default one
+        specific_bom.sequence = 0
+        template = self.product_ouvrage.product_tmpl_id
+        self.assertEqual(self.Bom._get_ouvrage_bom_values(template)[template.id]['bom_id'], self.bom_ouvrage.id)
+
+        self.Bom._cron_archive_specific_ouvrage_boms()
+        self.assertTrue(specific_bom.active, "Still used by a confirmed order")
+        so._action_cancel()
+        self.Bom._cron_archive_specific_ouvrage_boms()
+        self.assertFalse(specific_bom.active)
+        self.assertTrue(self.bom_ouvrage.active)
+
+    def test_deferred_specific_bom(self):
+        """ Test that specific BoMs are generated after the confirmation in deferred mode """
+        self.env.company.ouvrage_bom_async = True
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        ouvrage_line = self.SaleOrderLine.create({
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': 1.0,
+        })
+        comp_b = ouvrage_line.ouvrage_line_ids.filtered(lambda l: l.product_id == self.component_b)
+        comp_b.product_uom_qty = 5.0
+        so.action_confirm()
+
+        self.assertEqual(ouvrage_line.bom_id, self.bom_ouvrage, "BoM generation should be deferred")
+        self.assertTrue(ouvrage_line.ouvrage_bom_pending)
+
+        # Later edits do not change the captured structure
+        comp_b.product_uom_qty = 7.0
+        self.SaleOrderLine._cron_materialize_ouvrage_boms()
+        self.assertFalse(ouvrage_line.ouvrage_bom_pending)
+        self.assertTrue(ouvrage_line.bom_id.ouvrage_is_specific)
+        new_bom_line_b = ouvrage_line.bom_id.bom_line_ids.filtered(lambda l: l.product_id == self.component_b)
+        self.assertEqual(new_bom_line_b.product_qty, 5.0)
+
+    def test_ouvrage_pricelist_price(self):
+        """ Test that Ouvrages are priced through the order pricelist, with quantity breaks """
+        pricelist = self.env['product.pricelist'].create({
+            'name': 'Ouvrage Pricelist',
+            'item_ids': [(0, 0, {
+                'applied_on': '0_product_variant',
+                'product_id': self.component_b.id,
+                'compute_price': 'fixed',
+                'fixed_price': 8.0,
+                'min_quantity': 10.0,
+            })],
+        })
+        so = self.SaleOrder.create({'partner_id': self.partner.id, 'pricelist_id': pricelist.id})
+        small, large = self.SaleOrderLine.create([{
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': qty,
+        } for qty in (1.0, 5.0)])
+
+        # 2 x 10 + 20 below the break, 2 x 8 + 20 from 10 units of B
+        self.assertEqual(small.price_unit, 40.0)
+        self.assertEqual(large.price_unit, 36.0)
+
+        # Component prices are memoized for the transaction
+        pairs = [(self.component_b, 2.0), (self.component_b, 12.0), (self.component_c, 1.0)]
+        prices = pricelist._get_ouvrage_component_prices(pairs)
+        self.assertEqual(prices[(self.component_b.id, 12.0)], 8.0)
+        with self.assertQueryCount(0):
+            self.assertEqual(pricelist._get_ouvrage_component_prices(pairs), prices)
+
+    def test_configurator_totals(self):
+        """ Test that the configurator is opened saved, with server-side totals """
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        ouvrage_line = self.SaleOrderLine.create({
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': 1.0,
+        })
+        ouvrage_line.ouvrage_line_ids.purchase_price = 5.0
+        action = ouvrage_line.action_configure_ouvrage()
+        wizard = self.env['sale.ouvrage.configurator'].browse(action['res_id'])
+        self.assertEqual(len(wizard.component_ids), 2)
+
+        # 2 x 10 + 20 sold, 3 x 5 spent
+        self.assertEqual(wizard.amount_total, 40.0)
+        self.assertEqual(wizard.cost_total, 15.0)
+        self.assertEqual(wizard.margin_total, 25.0)
+
+        # Selecting the same BoM again keeps the edited components
+        wizard.component_ids.filtered(lambda c: c.product_id == self.component_c).quantity = 2.0
+        wizard._onchange_bom_id()
+        self.assertEqual(len(wizard.component_ids), 2)
+        self.assertEqual(wizard.amount_total, 60.0)
+
+    def test_ouvrage_tree_api(self):
+        """ Test the Ouvrage tree API: structure, fixed query count and incremental filter """
+        def tree_query_count(orders):
+            self.env.invalidate_all()
+            count = self.env.cr.sql_log_count
+            orders._get_ouvrage_tree()
+            return self.env.cr.sql_log_count - count
+
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        ouvrage_line = self.SaleOrderLine.create({
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': 2.0,
+        })
+        self.env.flush_all()
+        single_count = tree_query_count(so)
+
+        [tree] = so._get_ouvrage_tree()
+        [ouvrage_values] = tree['lines']
+        self.assertEqual(ouvrage_values['id'], ouvrage_line.id)
+        self.assertEqual(ouvrage_values['quantity'], 2.0)
+        self.assertEqual(ouvrage_values['margin'], ouvrage_line.ouvrage_margin)
+        components = {values['product_id']: values for values in ouvrage_values['components']}
+        self.assertEqual(components[self.component_b.id]['quantity'], 4.0)
+        self.assertTrue(components[self.component_b.id]['prices_hidden'])
+
+        # More orders and lines do not cost more queries
+        orders = so | so.copy() | so.copy()
+        self.env.flush_all()
+        self.assertEqual(tree_query_count(orders), single_count)
+
+        # Incremental sync only returns the orders modified since the date
+        self.assertFalse(orders._get_ouvrage_tree(since='2999-01-01 00:00:00'))
+        self.assertEqual(len(orders._get_ouvrage_tree(since='2000-01-01 00:00:00')), 3)
+
+    def test_order_form_lazy_components(self):
+        """ Test that the order form only reads the top-level lines and fetches components by batches """
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        ouvrage_line = self.SaleOrderLine.create({
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': 2.0,
+        })
+        line_spec = {'fields': {'product_id': {}, 'ouvrage_margin': {}}, 'limit': 40}
+        [values] = so.web_read({'order_line': line_spec})
+        self.assertEqual(len(values['order_line']), 3, "Without the context, the components are read")
+
+        [values] = so.web_read({'order_line': dict(line_spec, context={'ouvrage_lazy_components': True})})
+        self.assertEqual([line['id'] for line in values['order_line']], ouvrage_line.ids)
+        self.assertEqual(values['order_line'][0]['ouvrage_margin'], ouvrage_line.ouvrage_margin)
+
+        first = ouvrage_line.read_ouvrage_components(limit=1)
+        self.assertEqual(first['length'], 2)
+        self.assertEqual(len(first['records']), 1)
+        second = ouvrage_line.read_ouvrage_components(offset=1, limit=1)
+        self.assertEqual(
+            {values['id'] for values in first['records'] + second['records']},
+            set(ouvrage_line.ouvrage_line_ids.ids),
+        )
+
+    def test_nested_ouvrage_explosion(self):
+        """ Test the flattened explosion of nested Ouvrages and the cycle detection """
+        sub_ouvrage = self.Product.create({'name': 'Sub Ouvrage', 'type': 'consu', 'is_ouvrage': True})
+        sub_bom = self.Bom.create({
+            'product_tmpl_id': sub_ouvrage.product_tmpl_id.id,
+            'product_qty': 1.0,
+            'bom_line_ids': [(0, 0, {'product_id': self.component_b.id, 'product_qty': 2.0})],
+        })
+        top_ouvrage = self.Product.create({'name': 'Top Ouvrage', 'type': 'consu', 'is_ouvrage': True})
+        top_bom = self.Bom.create({
+            'product_tmpl_id': top_ouvrage.product_tmpl_id.id,
+            'product_qty': 1.0,
+            'bom_line_ids': [
+                (0, 0, {'product_id': sub_ouvrage.id, 'product_qty': 3.0}),
+                (0, 0, {'product_id': self.component_c.id, 'product_qty': 1.0}),
+            ],
+        })
+        explosion = {product: (ratio, depth) for product, ratio, _uom, depth in top_bom._get_ouvrage_explosion()}
+        self.assertEqual(explosion, {self.component_b: (6.0, 2), self.component_c: (1.0, 1)})
+
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        ouvrage_line = self.SaleOrderLine.create({
+            'order_id': so.id,
+            'product_id': top_ouvrage.id,
+            'product_uom_qty': 2.0,
+        })
+        comp_b = ouvrage_line.ouvrage_line_ids.filtered(lambda l: l.product_id == self.component_b)
+        self.assertEqual(comp_b.product_uom_qty, 12.0)
+        self.assertEqual(len(ouvrage_line.ouvrage_line_ids), 2)
+        self.assertEqual(ouvrage_line.price_unit, 6 * 10.0 + 20.0)
+
+        # An unmodified nested Ouvrage keeps its own BoM at confirmation
+        so.action_confirm()
+        self.assertEqual(ouvrage_line.bom_id, top_bom)
+
+        # Changing the sub-BoM refreshes the explosion of the Ouvrages using it
+        sub_bom.bom_line_ids.product_qty = 4.0
+        self.assertEqual(top_bom.ouvrage_explosion[0]['ratio'], 12.0)
+
+        # BoMs of other products get no explosion, even when they use an Ouvrage
+        plain_product = self.Product.create({'name': 'Plain Product', 'type': 'consu'})
+        plain_bom = self.Bom.create({
+            'product_tmpl_id': plain_product.product_tmpl_id.id,
+            'product_qty': 1.0,
+            'bom_line_ids': [(0, 0, {'product_id': top_ouvrage.id, 'product_qty': 1.0})],
+        })
+        plain_bom.bom_line_ids.product_qty = 2.0
+        sub_bom.bom_line_ids.product_qty = 5.0
+        self.assertFalse(plain_bom.ouvrage_explosion)
+        self.assertEqual(top_bom.ouvrage_explosion[0]['ratio'], 15.0)
+
+        # An Ouvrage cannot contain itself through a sub-Ouvrage
+        with self.assertRaises(ValidationError):
+            sub_bom.bom_line_ids = [(0, 0, {'product_id': top_ouvrage.id, 'product_qty': 1.0})]
+
+    def test_ouvrage_catalog_upsert(self):
+        """ Test the bulk upsert of catalog BoMs: line diffs, creation and per-BoM errors """
+        line_b = self.bom_ouvrage.bom_line_ids.filtered(lambda l: l.product_id == self.component_b)
+        component_d = self.Product.create({'name': 'Component D', 'type': 'consu', 'list_price': 5.0})
+        new_ouvrage = self.Product.create({'name': 'Ouvrage N', 'type': 'consu', 'is_ouvrage': True})
+        looping_ouvrage = self.Product.create({'name': 'Ouvrage L', 'type': 'consu', 'is_ouvrage': True})
+        sub_ouvrage = self.Product.create({'name': 'Ouvrage S', 'type': 'consu', 'is_ouvrage': True})
+        self.Bom.create({
+            'product_tmpl_id': looping_ouvrage.product_tmpl_id.id,
+            'bom_line_ids': [(0, 0, {'product_id': sub_ouvrage.id, 'product_qty': 1.0})],
+        })
+
+        result = self.Bom._ouvrage_catalog_upsert([
+            {'product_tmpl_id': self.product_ouvrage.product_tmpl_id.id, 'lines': [
+                {'product_id': self.component_b.id, 'product_qty': 3.0},
+                {'product_id': component_d.id, 'product_qty': 1.0},
+            ]},
+            {'product_tmpl_id': new_ouvrage.product_tmpl_id.id, 'hide_prices': True, 'lines': [
+                {'product_id': self.product_ouvrage.id, 'product_qty': 2.0},
+            ]},
+            {'product_tmpl_id': new_ouvrage.product_tmpl_id.id + 1000000, 'lines': []},
+            # Would contain itself through Ouvrage L
+            {'product_tmpl_id': sub_ouvrage.product_tmpl_id.id, 'lines': [
+                {'product_id': looping_ouvrage.id, 'product_qty': 1.0},
+            ]},
+        ])
+        self.assertEqual((result['created'], result['updated']), (1, 1))
+        self.assertEqual([index for index, _message in result['errors']], [2, 3])
+
+        # Lines are updated by diff
+        self.assertTrue(line_b.exists())
+        self.assertEqual(line_b.product_qty, 3.0)
+        self.assertEqual(self.bom_ouvrage.bom_line_ids.product_id, self.component_b | component_d)
+
+        # The explosions of the batch are refreshed at the end
+        new_bom = self.Bom.search([('product_tmpl_id', '=', new_ouvrage.product_tmpl_id.id)])
+        self.assertTrue(new_bom.hide_prices)
+        explosion = {product: ratio for product, ratio, _uom, _depth in new_bom._get_ouvrage_explosion()}
+        self.assertEqual(explosion, {self.component_b: 6.0, component_d: 2.0})
+
+    def test_confirm_keeps_bom_per_unit(self):
+        """ Test that components follow the BoM quantity per unit, and match it at confirmation """
+        self.env.company.ouvrage_bom_async = True
+        self.bom_ouvrage.product_qty = 2.0
+        so = self.SaleOrder.create({'partner_id': self.partner.id})
+        ouvrage_line = self.SaleOrderLine.create({
+            'order_id': so.id,
+            'product_id': self.product_ouvrage.id,
+            'product_uom_qty': 1.0,
+        })
+        comp_b = ouvrage_line.ouvrage_line_ids.filtered(lambda l: l.product_id == self.component_b)
+        self.assertEqual(comp_b.product_uom_qty, 1.0, "2 units of B for 2 Ouvrages")
+
+        so.action_confirm()
+        self.assertFalse(ouvrage_line.ouvrage_bom_pending, "An unmodified Ouvrage needs no specific BoM")
+        self.assertEqual(ouvrage_line.bom_id, self.bom_ouvrage)
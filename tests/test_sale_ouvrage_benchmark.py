@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+_logger = logging.getLogger(__name__)
+
+# Quotes of N Ouvrages x M components: small ones for the query budgets checked in every
+# run, larger ones for the opt-in benchmark
+BUDGET_SIZES = [(2, 5), (2, 20)]
+BENCHMARK_SIZES = [(10, 5), (10, 20), (50, 20)]
+
+# Query budgets per scenario: fixed part + part per Ouvrage. Budgets do not depend on
+# the number of components: a hot path issuing queries per component fails the build.
+QUERY_BUDGETS = {
+    'create_explode': (150, 2),
+    'scale': (60, 1),
+    'configurator': (150, 0),
+    'confirm_specific_bom': (400, 3),
+    'report_html': (200, 1),
+}
+
+# Set to a file path to write the benchmark results as JSON, e.g. to compare runs
+OUTPUT_ENV_VAR = 'SALE_OUVRAGE_BENCHMARK_OUTPUT'
+
+
+class TestSaleOuvrageQueryBudget(TransactionCase):
+    """ Query budgets of the Ouvrage hot paths, checked on small quotes in every run """
+
+    sizes = BUDGET_SIZES
+    # Pairs of plain product and Ouvrage lines of the tax totals scenario
+    tax_line_pairs = 8
+    # Whether wall times are logged and collected
+    report = False
+    results = []
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.partner = cls.env['res.partner'].create({'name': 'Benchmark Partner'})
+        cls.tax = cls.env['account.tax'].create({'name': 'Benchmark Tax', 'amount': 20.0})
+        cls.product = cls.env['product.product'].create({
+            'name': 'Plain Product',
+            'type': 'consu',
+            'list_price': 5.0,
+            'taxes_id': [(6, 0, cls.tax.ids)],
+        })
+        components = cls.env['product.product'].create([{
+            'name': f'Component {i}',
+            'type': 'consu',
+            'list_price': 10.0 + i,
+            'taxes_id': [(6, 0, cls.tax.ids)],
+        } for i in range(2)])
+        cls.product_ouvrage = cls.env['product.product'].create({
+            'name': 'Ouvrage',
+            'type': 'consu',
+            'is_ouvrage': True,
+        })
+        cls.env['mrp.bom'].create({
+            'product_tmpl_id': cls.product_ouvrage.product_tmpl_id.id,
+            'product_qty': 1.0,
+            'bom_line_ids': [(0, 0, {'product_id': c.id, 'product_qty': 2.0}) for c in components],
+        })
+
+        # One Ouvrage per number of components
+        cls.ouvrages_by_size = {}
+        for component_count in {m for _n, m in cls.sizes}:
+            ouvrage = cls.env['product.product'].create({
+                'name': f'Ouvrage {component_count}',
+                'type': 'consu',
+                'is_ouvrage': True,
+            })
+            components = cls.env['product.product'].create([{
+                'name': f'Ouvrage {component_count} - Component {i}',
+                'type': 'consu',
+                'list_price': 10.0 + i,
+                'standard_price': 5.0 + i,
+                'taxes_id': [(6, 0, cls.tax.ids)],
+            } for i in range(component_count)])
+            cls.env['mrp.bom'].create({
+                'product_tmpl_id': ouvrage.product_tmpl_id.id,
+                'product_qty': 1.0,
+                'bom_line_ids': [(0, 0, {'product_id': c.id, 'product_qty': 1.0 + i}) for i, c in enumerate(components)],
+            })
+            cls.ouvrages_by_size[component_count] = ouvrage
+
+    @contextmanager
+    def _measure(self, scenario, ouvrage_count, component_count):
+        """ Checks the SQL queries of the block against the query budget, and reports its wall time """
+        self.env.flush_all()
+        self.env.invalidate_all()
+        start_queries = self.cr.sql_log_count
+        start = time.perf_counter()
+        yield
+        self.env.flush_all()
+        duration = time.perf_counter() - start
+        queries = self.cr.sql_log_count - start_queries
+
+        fixed, per_ouvrage = QUERY_BUDGETS[scenario]
+        budget = fixed + per_ouvrage * ouvrage_count
+        if self.report:
+            self.results.append({
+                'scenario': scenario,
+                'ouvrages': ouvrage_count,
+                'components': component_count,
+                'seconds': round(duration, 4),
+                'queries': queries,
+                'query_budget': budget,
+            })
+            _logger.info(
+                "%s %sx%s: %.3fs, %s queries (budget %s)",
+                scenario, ouvrage_count, component_count, duration, queries, budget,
+            )
+        self.assertLessEqual(queries, budget, f"{scenario} {ouvrage_count}x{component_count} exceeds its query budget")
+
+    def _create_quote(self, ouvrage_count, component_count):
+        order = self.env['sale.order'].create({'partner_id': self.partner.id})
+        lines = self.env['sale.order.line'].create([{
+            'order_id': order.id,
+            'product_id': self.ouvrages_by_size[component_count].id,
+            'product_uom_qty': 1.0,
+        } for _i in range(ouvrage_count)])
+        return order, lines
+
+    def test_create_explode(self):
+        for ouvrage_count, component_count in self.sizes:
+            with self.subTest(ouvrages=ouvrage_count, components=component_count):
+                order = self.env['sale.order'].create({'partner_id': self.partner.id})
+                with self._measure('create_explode', ouvrage_count, component_count):
+                    self.env['sale.order.line'].create([{
+                        'order_id': order.id,
+                        'product_id': self.ouvrages_by_size[component_count].id,
+                        'product_uom_qty': 1.0,
+                    } for _i in range(ouvrage_count)])
+                self.assertEqual(len(order.order_line), ouvrage_count * (component_count + 1))
+
+    def test_scale(self):
+        for ouvrage_count, component_count in self.sizes:
+            with self.subTest(ouvrages=ouvrage_count, components=component_count):
+                _order, lines = self._create_quote(ouvrage_count, component_count)
+                with self._measure('scale', ouvrage_count, component_count):
+                    lines.write({'product_uom_qty': 1.1})
+                self.assertAlmostEqual(lines[0].ouvrage_line_ids[0].product_uom_qty, 1.1)
+
+    def test_configurator(self):
+        for ouvrage_count, component_count in self.sizes:
+            with self.subTest(ouvrages=ouvrage_count, components=component_count):
+                _order, lines = self._create_quote(ouvrage_count, component_count)
+                with self._measure('configurator', ouvrage_count, component_count):
+                    wizard = self.env['sale.ouvrage.configurator'].with_context(
+                        default_sale_line_id=lines[0].id,
+                        default_qty=lines[0].product_uom_qty,
+                    ).create({})
+                    wizard.component_ids[0].quantity += 1.0
+                    wizard.action_save()
+
+    def test_confirm_specific_bom(self):
+        for ouvrage_count, component_count in self.sizes:
+            with self.subTest(ouvrages=ouvrage_count, components=component_count):
+                order, lines = self._create_quote(ouvrage_count, component_count)
+                for line in lines:
+                    line.ouvrage_line_ids[0].product_uom_qty += 1.0
+                with self._measure('confirm_specific_bom', ouvrage_count, component_count):
+                    order.action_confirm()
+                self.assertEqual(len(lines.bom_id), 1, "Identical structures should share one specific BoM")
+
+    def test_report_html(self):
+        for ouvrage_count, component_count in self.sizes:
+            with self.subTest(ouvrages=ouvrage_count, components=component_count):
+                order, _lines = self._create_quote(ouvrage_count, component_count)
+                with self._measure('report_html', ouvrage_count, component_count):
+                    self.env['ir.actions.report']._render_qweb_html('sale.action_report_saleorder', order.ids)
+
+    def _time(self, func, repeat=5):
+        start = time.perf_counter()
+        for _i in range(repeat):
+            func()
+        return (time.perf_counter() - start) / repeat
+
+    def test_tax_totals_shared_computation(self):
+        """ Lines half of which are components: amounts and tax totals share one tax computation """
+        order = self.env['sale.order'].create({'partner_id': self.partner.id})
+        self.env['sale.order.line'].create([{
+            'order_id': order.id,
+            'product_id': product.id,
+            'product_uom_qty': 1.0,
+        } for _i in range(self.tax_line_pairs) for product in (self.product, self.product_ouvrage)])
+        self.assertEqual(len(order.order_line), 4 * self.tax_line_pairs)
+        self.env.flush_all()
+
+        def compute_both():
+            order._drop_ouvrage_tax_totals_cache()
+            order._compute_amounts()
+            order._compute_tax_totals()
+
+        uncached_order = order.with_context(sale_ouvrage_no_tax_cache=True)
+
+        def compute_both_uncached():
+            uncached_order._compute_amounts()
+            uncached_order._compute_tax_totals()
+
+        if self.report:
+            shared = self._time(compute_both)
+            separate = self._time(compute_both_uncached)
+            _logger.info(
+                "Tax totals of %s lines: shared %.3fs, separate %.3fs (%.0f%% saved)",
+                len(order.order_line), shared, separate, 100 * (1 - shared / separate),
+            )
+        compute_both()
+        self.assertEqual(order.tax_totals['total_amount_currency'], order.amount_total)
+
+        # The sharing itself is checked by counting the tax computations
+        AccountTax = self.registry['account.tax']
+        get_tax_totals_summary = AccountTax._get_tax_totals_summary
+        calls = []
+
+        def counting_get_tax_totals_summary(records, *args, **kwargs):
+            calls.append(records)
+            return get_tax_totals_summary(records, *args, **kwargs)
+
+        with patch.object(AccountTax, '_get_tax_totals_summary', counting_get_tax_totals_summary):
+            compute_both()
+        self.assertEqual(len(calls), 1, "Amounts and tax totals should share one tax computation")
+
+
+@tagged('-standard', 'sale_ouvrage_benchmark')
+class TestSaleOuvrageBenchmark(TestSaleOuvrageQueryBudget):
+    """ Benchmarks of the Ouvrage hot paths on larger quotes, with their wall times.
+    Run with --test-tags sale_ouvrage_benchmark """
+
+    sizes = BENCHMARK_SIZES
+    tax_line_pairs = 128
+    report = True
+    results = []
+
+    @classmethod
+    def tearDownClass(cls):
+        output = os.environ.get(OUTPUT_ENV_VAR)
+        if output and cls.results:
+            with open(output, 'w', encoding='utf-8') as f:
+                json.dump(cls.results, f, indent=2)
+        super().tearDownClass()
@@ -0,0 +1,16 @@
+from functools import partial
+
+
+def get_transaction_cache(env, key):
+    """
+    Returns the dict stored under `key` in the cache of the cursor, created on first use.
+    The cache must not outlive the transaction: it is dropped at commit and at rollback.
+    """
+    cr = env.cr
+    cache = cr.cache.get(key)
+    if cache is None:
+        cache = cr.cache[key] = {}
+        drop = partial(cr.cache.pop, key, None)
+        cr.postcommit.add(drop)
+        cr.postrollback.add(drop)
+    return cache
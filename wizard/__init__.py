@@ -1 +1,2 @@
 from . import ouvrage_configurator
+from . import ouvrage_import
@@ -1,4 +1,5 @@
 from odoo import models, fields, api
+from odoo.tools import float_compare, SQL
 
 class OuvrageConfigurator(models.TransientModel):
     _name = 'sale.ouvrage.configurator'
@@ -26,6 +27,7 @@ class OuvrageConfigurator(models.TransientModel):
             component_vals = []
             for child in line.ouvrage_line_ids:
                 component_vals.append((0, 0, {
+                    'sale_line_id': child.id,
                     'product_id': child.product_id.id,
                     'quantity': child.product_uom_qty,
                     'price_unit': child.price_unit,
@@ -41,29 +43,83 @@ class OuvrageConfigurator(models.TransientModel):
             })
         return res
 
+    # Totals of the components, aggregated by the server so the grid can be paged
+    amount_total = fields.Float(string="Total vente", compute='_compute_totals')
+    cost_total = fields.Float(string="Total coût", compute='_compute_totals')
+    margin_total = fields.Float(string="Marge totale", compute='_compute_totals')
+    margin_total_percent = fields.Float(string="Marge totale %", compute='_compute_totals')
+
+    @api.depends('component_ids.price_unit', 'component_ids.cost', 'component_ids.quantity', 'component_ids.discount')
+    def _compute_totals(self):
+        # Saved wizards are summed in SQL, without loading their components; wizards being
+        # edited in an onchange are summed from their (possibly modified) components
+        totals = self.filtered('id')._get_component_totals()
+        for wizard in self:
+            if wizard.id:
+                amount, cost = totals.get(wizard.id, (0.0, 0.0))
+            else:
+                amount = sum(comp.price_unit * (1 - (comp.discount or 0.0) / 100.0) * comp.quantity for comp in wizard.component_ids)
+                cost = sum(comp.cost * comp.quantity for comp in wizard.component_ids)
+            wizard.amount_total = amount
+            wizard.cost_total = cost
+            wizard.margin_total = amount - cost
+            wizard.margin_total_percent = (amount - cost) / amount if amount else 0.0
+
+    def _get_component_totals(self):
+        """ Returns {wizard_id: (sale amount, cost)} of the components, summed in SQL """
+        if not self:
+            return {}
+        self.env['sale.ouvrage.component'].flush_model(['wizard_id', 'price_unit', 'cost', 'quantity', 'discount'])
+        self.env.cr.execute(SQL(
+            """
+            SELECT wizard_id,
+                   SUM(price_unit * (1 - COALESCE(discount, 0) / 100) * quantity),
+                   SUM(cost * quantity)
+              FROM sale_ouvrage_component
+             WHERE wizard_id = ANY(%s)
+          GROUP BY wizard_id
+            """,
+            self.ids,
+        ))
+        return {wizard_id: (amount or 0.0, cost or 0.0) for wizard_id, amount, cost in self.env.cr.fetchall()}
+
     @api.onchange('bom_id')
     def _onchange_bom_id(self):
         # User requirement: "A partie du moment ou j'ai sélectionné une nomenclature, les composants doivent être figés"
-        # Implies we don't auto-reload unless initialized? 
         # But "Un champ 'nomenclature' ... J'ai la possibilité d'en sélectionner un autre, dans ce cas les composants sont recalculés par rapport à cette nomenclature."
-        if self.bom_id:
-             self.hide_prices = self.bom_id.hide_prices
-             self.hide_structure = self.bom_id.hide_structure
-             # Reload components from BoM
-             lines = []
-             factor = self.qty or 1.0
-             for bom_line in self.bom_id.bom_line_ids:
-                lines.append((0, 0, {
-                    'product_id': bom_line.product_id.id,
-                    'quantity': bom_line.product_qty * factor,
-                    'price_unit': bom_line.product_id.list_price, # or standard calculation
-                    'cost': bom_line.product_id.standard_price,
-                    'discount': 0.0,
-                }))
-             self.component_ids = [(5, 0, 0)] + lines # Clear and add
+        # Only rebuild the grid when another BoM is actually selected
+        if self.bom_id and self.bom_id != self._origin.bom_id:
+            self._load_bom_components()
+
+    def _load_bom_components(self):
+        """ Replaces the components by the ones of the selected BoM """
+        self.hide_prices = self.bom_id.hide_prices
+        self.hide_structure = self.bom_id.hide_structure
+        lines = []
+        factor = self.qty or 1.0
+        explosion = self.bom_id._get_ouvrage_explosion()
+        # Components priced through the order pricelist, all at once
+        order = self.sale_line_id.order_id
+        prices = {}
+        if order.pricelist_id:
+            prices = order.pricelist_id._get_ouvrage_component_prices(
+                [(product, ratio * factor) for product, ratio, _uom, _depth in explosion],
+                date=order.date_order,
+            )
+        for product, ratio, _uom, _depth in explosion:
+            quantity = ratio * factor
+            lines.append((0, 0, {
+                'product_id': product.id,
+                'quantity': quantity,
+                'price_unit': prices.get((product.id, quantity), product.list_price),
+                'cost': product.standard_price,
+                'discount': 0.0,
+            }))
+        self.component_ids = [(5, 0, 0)] + lines # Clear and add
 
     def action_initialize(self):
-        self._onchange_bom_id()
+        if self.bom_id:
+            self._load_bom_components()
 
     def action_save(self):
         self.ensure_one()
@@ -78,26 +134,46 @@ class OuvrageConfigurator(models.TransientModel):
         })
         
         # 2. Sync Components
-        # Strategy: Delete all existing children and recreate. 
-        # This is destructive but ensures exact match with wizard.
+        # Strategy: diff the wizard components against the existing children, then update
+        # changed lines in place, create the new ones and delete the removed ones in batch.
         # Check if line is locked/confirmed? Assuming Draft/Sent state.
-        line.ouvrage_line_ids.unlink()
-        
+        SaleOrderLine = self.env['sale.order.line']
+        existing = line.ouvrage_line_ids
+        unmatched = existing - self.component_ids.sale_line_id
+        to_write = {}
         new_children = []
         for comp in self.component_ids:
-            new_children.append({
-                'order_id': line.order_id.id,
-                'product_id': comp.product_id.id,
-                'product_uom_qty': comp.quantity,
-                'price_unit': comp.price_unit,
-                'purchase_price': comp.cost,
-                'discount': comp.discount,
-                'ouvrage_parent_line_id': line.id,
-                'sequence': line.sequence + 1,
-            })
-        
+            vals = comp._prepare_sale_line_vals()
+            child = comp.sale_line_id & existing
+            if not child:
+                # Components reloaded from a BoM: reuse a remaining line of the same product
+                child = unmatched.filtered(lambda l: l.product_id == comp.product_id)[:1]
+                unmatched -= child
+            if child:
+                # Changed lines get all their values: writing the quantity alone would let the
+                # price and discount computes of the line override the ones set in the wizard
+                if comp._sale_line_differs(child, vals):
+                    if child.product_id.id == vals['product_id']:
+                        # Writing the same product would still recompute the name, UoM and
+                        # taxes of the line, losing the ones set by the explosion
+                        del vals['product_id']
+                    to_write.setdefault(tuple(sorted(vals.items())), []).append(child.id)
+            else:
+                new_children.append(dict(vals, **{
+                    'order_id': line.order_id.id,
+                    'ouvrage_parent_line_id': line.id,
+                    'sequence': line.sequence + 1,
+                }))
+
+        if unmatched:
+            unmatched.unlink()
+        for changes, child_ids in to_write.items():
+            SaleOrderLine.browse(child_ids).write(dict(changes))
         if new_children:
-            self.env['sale.order.line'].create(new_children)
+            SaleOrderLine.create(new_children)
+
+        # 3. Reprice the Ouvrage once, now that its components are up to date
+        self.env['sale.order.line']._process_ouvrage_reprice_queue()
 
         return {'type': 'ir.actions.act_window_close'}
 
@@ -105,7 +181,8 @@ class OuvrageComponent(models.TransientModel):
     _name = 'sale.ouvrage.component'
     _description = 'Temporary component line for wizard'
 
-    wizard_id = fields.Many2one('sale.ouvrage.configurator', string="Wizard")
+    wizard_id = fields.Many2one('sale.ouvrage.configurator', string="Wizard", ondelete='cascade', index=True)
+    sale_line_id = fields.Many2one('sale.order.line', string="Ligne composant")
     product_id = fields.Many2one('product.product', string="Produit", required=True)
     quantity = fields.Float(string="Quantité", default=1.0)
     price_unit = fields.Float(string="Prix Unitaire")
@@ -124,3 +201,32 @@ class OuvrageComponent(models.TransientModel):
                 line.margin_percent = (price_effective - line.cost) / price_effective
             else:
                 line.margin_percent = 0.0
+
+    @api.model
+    def _sale_line_differs(self, sale_line, vals):
+        """ Returns whether the values written by the wizard would change the sale line """
+        for fname, value in vals.items():
+            field = sale_line._fields[fname]
+            current = sale_line[fname]
+            if field.type == 'many2one':
+                if current.id != value:
+                    return True
+            elif field.type in ('float', 'monetary'):
+                if float_compare(current, value, precision_digits=6):
+                    return True
+            elif current != value:
+                return True
+        return False
+
+    def _prepare_sale_line_vals(self):
+        """ Returns the values of the component sale line matching this wizard line """
+        self.ensure_one()
+        ouvrage_qty = self.wizard_id.qty
+        return {
+            'product_id': self.product_id.id,
+            'product_uom_qty': self.quantity,
+            'ouvrage_qty_per_unit': self.quantity / ouvrage_qty if ouvrage_qty else self.quantity,
+            'price_unit': self.price_unit,
+            'purchase_price': self.cost,
+            'discount': self.discount,
+        }
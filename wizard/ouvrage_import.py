@@ -0,0 +1,117 @@
+import base64
+import csv
+import io
+import threading
+
+from odoo import models, fields, api, exceptions
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Accepted column headers (lower case) for each imported value
+IMPORT_COLUMNS = {
+    'reference': ('reference', 'référence', 'code', 'default_code'),
+    'quantity': ('quantity', 'quantité', 'qty', 'qté'),
+    'description': ('description', 'désignation', 'name'),
+    'price_unit': ('price_unit', 'prix unitaire', 'pu'),
+}
+
+
+class OuvrageImport(models.TransientModel):
+    _name = 'sale.ouvrage.import'
+    _description = 'Wizard to import a bill of quantities (DPGF/BPU) in a quotation'
+
+    order_id = fields.Many2one('sale.order', string="Devis", required=True)
+    file = fields.Binary(string="Fichier", required=True, attachment=False)
+    filename = fields.Char(string="Nom du fichier")
+    chunk_size = fields.Integer(string="Taille des lots", default=500)
+    state = fields.Selection([('draft', "Brouillon"), ('done', "Terminé")], default='draft')
+    row_count = fields.Integer(string="Lignes lues", readonly=True)
+    line_count = fields.Integer(string="Lignes importées", readonly=True)
+    error_log = fields.Text(string="Erreurs", readonly=True)
+
+    def action_import(self):
+        self.ensure_one()
+        if self.chunk_size <= 0:
+            raise exceptions.UserError("La taille des lots doit être positive.")
+        result = self.order_id._import_ouvrage_lines(
+            self._iter_rows(), chunk_size=self.chunk_size, progress=self._notify_progress)
+        self.write({
+            'state': 'done',
+            'row_count': result['processed'],
+            'line_count': result['created'],
+            'error_log': '\n'.join(f"Ligne {row_number} : {message}" for row_number, message in result['errors']),
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def _notify_progress(self, result):
+        """
+        Notifies the user of the progress of the import. The notification is sent with a cursor
+        of its own, as the import transaction is only committed at the end.
+        """
+        notification = {
+            'type': 'info',
+            'title': f"Import dans {self.order_id.name}",
+            'message': f"{result['processed']} lignes lues, {result['created']} importées, {len(result['errors'])} erreurs",
+        }
+        if getattr(threading.current_thread(), 'testing', False):
+            self.env['bus.bus']._sendone(self.env.user.partner_id, 'simple_notification', notification)
+            return
+        with self.env.registry.cursor() as cr:
+            env = self.env(cr=cr)
+            env['bus.bus']._sendone(env.user.partner_id, 'simple_notification', notification)
+
+    def _iter_rows(self):
+        """ Streams the rows of the file as (row_number, {column: value}) pairs """
+        self.ensure_one()
+        content = base64.b64decode(self.file)
+        if (self.filename or '').lower().endswith('.xlsx'):
+            if openpyxl is None:
+                raise exceptions.UserError("La bibliothèque openpyxl est nécessaire pour importer des fichiers XLSX.")
+            workbook = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+            rows = workbook.active.iter_rows(values_only=True)
+        else:
+            text = io.TextIOWrapper(io.BytesIO(content), encoding='utf-8-sig', newline='')
+            sample = text.read(4096)
+            text.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            rows = csv.reader(text, dialect)
+
+        header = next(rows, None)
+        if not header:
+            raise exceptions.UserError("Le fichier est vide.")
+        columns = self._map_columns(header)
+        for row_number, row in enumerate(rows, start=2):
+            if not row or not any(cell not in (None, '') for cell in row):
+                continue
+            yield row_number, {
+                key: row[index] if index < len(row) else None
+                for key, index in columns.items()
+            }
+
+    @api.model
+    def _map_columns(self, header):
+        """ Returns {column key: index in the row} from the header row """
+        names = [str(name or '').strip().lower() for name in header]
+        columns = {}
+        for key, aliases in IMPORT_COLUMNS.items():
+            for index, name in enumerate(names):
+                if name in aliases:
+                    columns[key] = index
+                    break
+        missing = [key for key in ('reference', 'quantity') if key not in columns]
+        if missing:
+            raise exceptions.UserError(f"Colonnes manquantes : {', '.join(missing)}")
+        return columns
+